@@ -1,14 +1,20 @@
-from fastapi import APIRouter, UploadFile, File, Request, Response, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, UploadFile, File, Form, Request, Response, Depends, HTTPException
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 
-import pandas as pd
 from io import StringIO, BytesIO
-import time
 
-from app.crud import file_handler
-from app.utils.config import TEMP_DICT, RES_DICT, DURATION
-from app.crud.openai import intent_prompt, insight_prompt, system_prompt, generate_prompt, analyze_intent, analyze_insight, combine_results
+from app.crud import charts
+from app.crud.llm_scheduler import scheduler, LLMBusy
+from app.utils import metrics, assets
+from app.utils.env import LAZY_STARTUP
+from app.utils.lazy import lazy_import
+from app.utils.metrics import span
+
+# modules pulling in pandas and the LLM SDK, loaded on first use in lazy startup
+file_handler = lazy_import("app.crud.file_handler", LAZY_STARTUP)
+jobs = lazy_import("app.crud.jobs", LAZY_STARTUP)
+config = lazy_import("app.utils.config", LAZY_STARTUP)
 
 from pathlib import Path
 import json
@@ -20,7 +26,12 @@ json_path_ins = BASE_DIR / "lib" / "TEST_INSRES.json"
 
 router = APIRouter()
 
+# report table paging
+ROWS_PAGE_SIZE = 10
+ROWS_MAX_PAGE_SIZE = 100
+
 templates = Jinja2Templates(directory="app/templates")
+templates.env.globals["static_url"] = assets.static_url
 
 ERROR_MESSAGES = {
     "analysis_failed": "Something went wrong while executing the analysis. Please try again.",
@@ -29,14 +40,30 @@ ERROR_MESSAGES = {
     "session_expired": "Your session has expired. Please upload your file again.",
     "not_found": "Page not found (404).",
     "forbidden":"You don’t have permission to access this (403).",
-    "failed_read":"Failed to read the file."
+    "failed_read":"Failed to read the file.",
+    "llm_busy": "The analysis service is busy right now. Please try again in a moment.",
+    "job_running": "The analysis is still running. Please wait until the report is ready."
 }
 
+# busy page (503 with Retry-After), retries the analysis when the wait is over
+def busy_response(request : Request, clean_id : str, retry_after : int):
+    return templates.TemplateResponse(
+        "busy.html",
+        {
+            "request": request,
+            "clean_id": clean_id,
+            "retry_after": retry_after,
+            "is_active": True
+        },
+        status_code=503,
+        headers={"Retry-After": str(retry_after)}
+    )
+
 @router.get('/', response_class=HTMLResponse)
 def index(request : Request):   
     # check if there is active session
     session_id = request.cookies.get("session_id")
-    if session_id and session_id in TEMP_DICT:
+    if session_id and session_id in config.SESSION_STORE:
         return RedirectResponse(url=f'/report/{session_id}', status_code=303)
     
     # otherwise
@@ -53,7 +80,7 @@ def index(request : Request):
     return response
 
 @router.post('/upload', response_class=HTMLResponse)
-async def upload_file(request : Request, file: UploadFile = File(...)):
+async def upload_file(request : Request, file: UploadFile = File(...), sheet: str = Form(None)):
     # validate file type
     if not file_handler.validate_file(file.filename.lower()):
         response = RedirectResponse(url='/', status_code=303)
@@ -63,7 +90,9 @@ async def upload_file(request : Request, file: UploadFile = File(...)):
     
     # read file to dataframe
     try:
-        clean_id = await file_handler.read_validate_file(file)
+        timings = {}
+        with span("parse", timings):
+            clean_id = await file_handler.read_validate_file(file, sheet)
         if clean_id is None:
             response = RedirectResponse(url='/', status_code=303)
             response.set_cookie(key="error_msg", value="invalid_dataset", max_age=5)
@@ -75,6 +104,10 @@ async def upload_file(request : Request, file: UploadFile = File(...)):
         response.set_cookie(key="error_msg", value="failed_read")
 
         return response
+
+    # a shared dataset keeps the timings of the upload that analyzed it
+    if jobs.get_status(clean_id) is None:
+        config.SESSION_STORE.update(clean_id, timings=timings)
     
     # Create the redirect object first
     redirect = RedirectResponse(url=f'/clean/{clean_id}', status_code=303)
@@ -86,10 +119,7 @@ async def upload_file(request : Request, file: UploadFile = File(...)):
     
 
 @router.get('/clean/{clean_id}')
-def clean(request : Request, clean_id : str):
-    # set timer
-    start = time.perf_counter()
-    
+async def clean(request : Request, clean_id : str):
     # if cookie_id and clean_id do not match
     cookie_id = request.cookies.get("session_id")
     if cookie_id and cookie_id != clean_id:
@@ -106,57 +136,45 @@ def clean(request : Request, clean_id : str):
 
         return response
     
-    try:
-        sum([i**2 for i in range(1000000)])
+    # shed load before any work is done when the LLM queue is full
+    if jobs.get_status(clean_id) is None and not scheduler.admits():
+        return busy_response(request, clean_id, scheduler.retry_after())
 
-        # micro clean dataframe
-        processed_df = file_handler.micro_clean(df)
+    # enqueue analysis, a refresh does not re-run an existing job
+    jobs.start_job(clean_id)
 
-        # generate intent
-        intent = generate_prompt(system_prompt(), intent_prompt(processed_df))
-        intent_res = analyze_intent(processed_df, intent.choices[0].message.content)
+    return RedirectResponse(url=f'/report/{clean_id}', status_code=303)
 
-        if intent_res is None:
-            TEMP_DICT.pop(clean_id, None)
-            RES_DICT.pop(clean_id, None)
-            DURATION.pop(clean_id, None)
 
-            response = RedirectResponse(url='/', status_code=303)
-            response.delete_cookie("session_id")
-            
-            response.set_cookie(key="error_msg", value="analysis_failed", max_age=5)
-            
-            return response
-        
-        # generate insight
-        insight = generate_prompt(system_prompt(), insight_prompt(intent_res))
-        insight_res = analyze_insight(insight.choices[0].message.content)
+@router.get('/status/{clean_id}')
+def status(request : Request, clean_id : str):
+    cookie_id = request.cookies.get("session_id")
 
-        # combine intent and insight results
-        combined_results = combine_results(intent_res, insight_res)
+    # cookie does not exist or does not match
+    if not cookie_id or cookie_id != clean_id:
+        return JSONResponse({"error": ERROR_MESSAGES["forbidden"]}, status_code=403)
 
-        end = time.perf_counter()
-        duration = end - start
+    job = jobs.get_status(clean_id)
+    if job is None:
+        return JSONResponse({"error": ERROR_MESSAGES["not_found"]}, status_code=404)
 
-        # save to temporary dict
-        TEMP_DICT[clean_id] = processed_df #update to processed df
-        RES_DICT[clean_id] = combined_results
-        DURATION[clean_id] = duration
+    return JSONResponse(job)
 
-    except Exception as e:
-        print(f"Error during cleaning: {e}")
 
-        TEMP_DICT.pop(clean_id, None)
-        RES_DICT.pop(clean_id, None)
-        DURATION.pop(clean_id, None)
+@router.get('/events/{clean_id}')
+async def events(request : Request, clean_id : str):
+    cookie_id = request.cookies.get("session_id")
 
-        response = RedirectResponse(url='/', status_code=303)
-        response.delete_cookie("session_id")
-        response.set_cookie(key="error_msg", value="analysis_failed", max_age=5)
-        
-        return response
+    # cookie does not exist or does not match
+    if not cookie_id or cookie_id != clean_id:
+        return JSONResponse({"error": ERROR_MESSAGES["forbidden"]}, status_code=403)
 
-    return RedirectResponse(url=f'/report/{clean_id}', status_code=303)
+    # topics and insights are pushed as they complete, the page reloads when the job ends
+    return StreamingResponse(
+        jobs.job_events(clean_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get('/report/{clean_id}')
@@ -177,10 +195,39 @@ def report(request : Request, clean_id : str):
         
         return response
     
+    # analysis still running, show progress page that polls /status
+    job = jobs.get_status(clean_id)
+    if job is not None and job["status"] not in ("done", jobs.JOB_FAILED):
+        return templates.TemplateResponse(
+            "processing.html",
+            {
+                "request":request,
+                "clean_id": clean_id,
+                "job": job,
+                "is_active":True
+            }
+        )
+
+    # turned away by the LLM scheduler, keep the upload and retry later
+    if job is not None and job["status"] == jobs.JOB_FAILED and job["error"] == jobs.JOB_BUSY:
+        jobs.reset_job(clean_id)
+        return busy_response(request, clean_id, job["retry_after"] or scheduler.retry_after())
+
+    # analysis failed
+    if job is not None and job["status"] == jobs.JOB_FAILED:
+        jobs.clear_session(clean_id)
+
+        response = RedirectResponse(url='/', status_code=303)
+        response.delete_cookie("session_id")
+        response.set_cookie(key="error_msg", value=job["error"] or "analysis_failed", max_age=5)
+
+        return response
+
     # else
-    processed_df = TEMP_DICT.get(clean_id)
-    combined_results = RES_DICT.get(clean_id)
-    duration = DURATION.get(clean_id)
+    record = config.SESSION_STORE.get(clean_id) or {}
+    processed_df = record.get("df")
+    combined_results = record.get("results")
+    duration = record.get("duration")
 
     if processed_df is None or combined_results is None or duration is None:
         response = RedirectResponse(url="/", status_code=303)
@@ -188,28 +235,167 @@ def report(request : Request, clean_id : str):
 
         return response
     
-    return templates.TemplateResponse(
-        "report.html",
-        {
-            "request":request,
-            "columns": list(processed_df.columns),
-            "dtypes":processed_df.dtypes,
-            "rows": processed_df.to_dict("records"),
-            "openai_response": combined_results,
-            "success":"Data is successfully analyzed.",
-            "runtime":round(duration,2),
-            "is_active":True
-        }
+    # only the first page is rendered, the rest is served by /rows
+    first_page = file_handler.paginate_rows(processed_df, start=0, length=ROWS_PAGE_SIZE)
+
+    with span("render"):
+        return templates.TemplateResponse(
+            "report.html",
+            {
+                "request":request,
+                "clean_id": clean_id,
+                "columns": list(processed_df.columns),
+                "dtypes":processed_df.dtypes,
+                "rows": first_page["data"],
+                "total_rows": first_page["recordsTotal"],
+                "page_size": ROWS_PAGE_SIZE,
+                "openai_response": combined_results,
+                "success":"Data is successfully analyzed.",
+                "runtime":round(duration,2),
+                "timings": record.get("timings") or {},
+                "tokens": record.get("tokens") or {},
+                "truncation": record.get("truncation") or {},
+                "is_active":True
+            }
+        )
+
+
+@router.get('/intents/{clean_id}')
+def intents(request : Request, clean_id : str):
+    cookie_id = request.cookies.get("session_id")
+
+    # cookie does not exist or does not match
+    if not cookie_id or cookie_id != clean_id:
+        return JSONResponse({"error": ERROR_MESSAGES["forbidden"]}, status_code=403)
+
+    # intents of the current report, the starting point for /rerun
+    record = config.SESSION_STORE.get_meta(clean_id)
+    if record is None or record.get("results") is None:
+        return JSONResponse({"error": ERROR_MESSAGES["not_found"]}, status_code=404)
+
+    return JSONResponse({"intents": record.get("intents") or []})
+
+
+@router.post('/rerun/{clean_id}')
+async def rerun(request : Request, clean_id : str):
+    cookie_id = request.cookies.get("session_id")
+
+    # cookie does not exist or does not match
+    if not cookie_id or cookie_id != clean_id:
+        return JSONResponse({"error": ERROR_MESSAGES["forbidden"]}, status_code=403)
+
+    # a list of intents, or {"intents": [...]} as returned by /intents
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Invalid JSON body."}, status_code=400)
+    if isinstance(body, dict):
+        body = body.get("intents")
+
+    job = jobs.get_status(clean_id)
+    if job is None:
+        return JSONResponse({"error": ERROR_MESSAGES["not_found"]}, status_code=404)
+
+    # only new or edited topics are computed, the report shows the new results
+    # (the re-run claims the job, a running analysis or re-run turns it away)
+    try:
+        outcome = await jobs.rerun_job(clean_id, body)
+    except jobs.JobRunning:
+        return JSONResponse({"error": ERROR_MESSAGES["job_running"]}, status_code=409)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except LLMBusy as e:
+        return JSONResponse({"error": ERROR_MESSAGES["llm_busy"]}, status_code=503,
+                            headers={"Retry-After": str(e.retry_after)})
+    except Exception:
+        # logged and kept on the job record by rerun_job
+        return JSONResponse({"error": ERROR_MESSAGES["analysis_failed"]}, status_code=500)
+
+    if outcome is None:
+        return JSONResponse({"error": ERROR_MESSAGES["session_expired"]}, status_code=404)
+
+    return JSONResponse(outcome)
+
+
+@router.get('/metrics')
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get('/rows/{clean_id}')
+def rows(request : Request, clean_id : str):
+    cookie_id = request.cookies.get("session_id")
+
+    # cookie does not exist or does not match
+    if not cookie_id or cookie_id != clean_id:
+        return JSONResponse({"error": ERROR_MESSAGES["forbidden"]}, status_code=403)
+
+    processed_df = config.SESSION_STORE.get_df(clean_id)
+    if processed_df is None:
+        return JSONResponse({"error": ERROR_MESSAGES["not_found"]}, status_code=404)
+
+    # DataTables server-side parameters
+    params = request.query_params
+    try:
+        draw = int(params.get("draw", 1))
+        start = max(int(params.get("start", 0)), 0)
+        length = int(params.get("length", ROWS_PAGE_SIZE))
+        order_col = params.get("order[0][column]")
+        order_col = int(order_col) if order_col is not None else None
+    except ValueError:
+        return JSONResponse({"error": "Invalid paging parameters."}, status_code=400)
+
+    # cap page size so a single request cannot pull the whole dataset
+    if length < 0 or length > ROWS_MAX_PAGE_SIZE:
+        length = ROWS_MAX_PAGE_SIZE
+
+    page = file_handler.paginate_rows(
+        processed_df,
+        start=start,
+        length=length,
+        search=params.get("search[value]"),
+        order_col=order_col,
+        order_dir=params.get("order[0][dir]", "asc")
     )
+    page["draw"] = draw
+
+    return JSONResponse(page)
+
+
+@router.get('/chart/{clean_id}/{index}')
+def chart(request : Request, clean_id : str, index : int):
+    cookie_id = request.cookies.get("session_id")
+
+    # cookie does not exist or does not match
+    if not cookie_id or cookie_id != clean_id:
+        return JSONResponse({"error": ERROR_MESSAGES["forbidden"]}, status_code=403)
+
+    # results only, the dataframe is not loaded
+    record = config.SESSION_STORE.get_meta(clean_id)
+    results = record.get("results") if record is not None else None
+    if not results or index < 0 or index >= len(results):
+        return JSONResponse({"error": ERROR_MESSAGES["not_found"]}, status_code=404)
+
+    try:
+        max_points = int(request.query_params.get("max_points", charts.CHART_MAX_POINTS))
+    except ValueError:
+        return JSONResponse({"error": "Invalid max_points."}, status_code=400)
+
+    payload = charts.chart_data(results[index], max_points)
+    headers = {"ETag": charts.chart_etag(payload), "Cache-Control": "private, no-cache"}
+
+    # unchanged since the browser's copy
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(payload, headers=headers)
 
 
 @router.get('/quit_report', response_class=HTMLResponse)
 async def quit_report(request : Request):
     cookie_id = request.cookies.get("session_id")
         
-    TEMP_DICT.pop(cookie_id, None)
-    RES_DICT.pop(cookie_id, None)
-    DURATION.pop(cookie_id, None)
+    jobs.clear_session(cookie_id)
 
     response = RedirectResponse(url='/', status_code=303)
     response.delete_cookie("session_id")
@@ -220,7 +406,7 @@ async def quit_report(request : Request):
 def about(request : Request):
     # check if there is active session
     session_id = request.cookies.get("session_id")
-    if session_id and session_id in TEMP_DICT:
+    if session_id and session_id in config.SESSION_STORE:
         return RedirectResponse(url=f'/report/{session_id}', status_code=303)
     
     return templates.TemplateResponse("about.html", 
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import math
+
+from app.utils.env import CHART_MAX_POINTS
+
+# number or None, like the report's parseFloat
+def to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value if math.isfinite(value) else None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+# record rows to a label column and numeric series
+def columns_of_records(rows: list) -> tuple:
+    first = rows[0]
+    label, series = None, []
+    for key in first:
+        # strings and non-numbers label the rows, the last one wins (nulls are skipped)
+        value = next((row.get(key) for row in rows if row.get(key) is not None), None)
+        if isinstance(value, str) or to_number(value) is None:
+            label = key
+        else:
+            series.append(key)
+
+    if label is None:
+        label = next(iter(first))
+        series = [key for key in series if key != label]
+
+    labels = [str(row.get(label)) for row in rows]
+    values = {key: [to_number(row.get(key)) for row in rows] for key in series}
+    return label, labels, values
+
+# correlation matrix {column: {column: r}} to one series per column
+def columns_of_matrix(matrix: dict) -> tuple:
+    labels = list(matrix.keys())
+    values = {column: [to_number(matrix[column].get(row)) for row in labels] for column in labels}
+    return "variable", labels, values
+
+# largest-triangle-three-buckets, keeps the visual shape of a line with fewer points
+def downsample_indexes(values: list, max_points: int) -> list:
+    n = len(values)
+    if max_points < 3 or n <= max_points:
+        return list(range(n))
+
+    y = [v if v is not None else 0.0 for v in values]
+    bucket = (n - 2) / (max_points - 2)
+    keep = [0]
+    previous = 0
+
+    for i in range(max_points - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+
+        # average of the next bucket is the third triangle point
+        next_start, next_end = end, min(int((i + 2) * bucket) + 1, n)
+        next_x = (next_start + next_end - 1) / 2
+        next_y = sum(y[next_start:next_end]) / max(next_end - next_start, 1)
+
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((previous - next_x) * (y[j] - y[previous]) - (previous - j) * (next_y - y[previous]))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        previous = best
+
+    keep.append(n - 1)
+    return keep
+
+# columnar chart data of one analysis result
+def chart_data(item: dict, max_points: int = CHART_MAX_POINTS) -> dict:
+    result = item.get("result")
+    chart_type = (item.get("chart_type") or "bar").lower()
+
+    if isinstance(result, dict) and all(isinstance(v, dict) for v in result.values()):
+        label, labels, values = columns_of_matrix(result)
+    elif isinstance(result, list) and result and all(isinstance(row, dict) for row in result):
+        label, labels, values = columns_of_records(result)
+    else:
+        label, labels, values = None, [], {}
+
+    total = len(labels)
+    downsampled = False
+    if chart_type == "line" and values and total > max_points:
+        keep = downsample_indexes(next(iter(values.values())), max_points)
+        labels = [labels[i] for i in keep]
+        values = {key: [column[i] for i in keep] for key, column in values.items()}
+        downsampled = True
+
+    return {
+        "topic": item.get("topic"),
+        "chart_type": chart_type,
+        "label": label,
+        "labels": labels,
+        "series": [{"name": key, "values": column} for key, column in values.items()],
+        "points": total,
+        "downsampled": downsampled
+    }
+
+# strong validator of a chart payload
+def chart_etag(payload: dict) -> str:
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
@@ -0,0 +1,340 @@
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.crud.file_handler import apply_column_types
+from app.crud.openai import try_parse_json
+from app.crud.planner import compile_plan, explain_plan, build_mask, observed_groups, finalize_result, SUPPORTED_AGGS
+from app.utils.env import LARGE_CHUNK_ROWS, MEDIAN_SKETCH_SIZE
+from app.utils.metrics import TOPIC_SECONDS, FAILED_TOPICS
+
+logger = logging.getLogger(__name__)
+
+# partial statistics needed per aggregation, and how partials merge
+AGG_STATS = {
+    "sum": ["sum"],
+    "count": ["count"],
+    "mean": ["sum", "count"],
+    "min": ["min"],
+    "max": ["max"],
+    "median": []
+}
+MERGE_STATS = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+
+class MedianSketch:
+    """
+        Bounded reservoir sample of a stream, the median of the reservoir
+        approximates the stream median.
+    """
+
+    def __init__(self, size: int = MEDIAN_SKETCH_SIZE, seed: int = 0):
+        self.size = size
+        self.seen = 0
+        self.values = np.empty(0)
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+
+        # fill the reservoir first
+        room = self.size - len(self.values)
+        if room > 0:
+            self.values = np.concatenate([self.values, values[:room]])
+            self.seen += min(room, len(values))
+            values = values[room:]
+
+        if len(values) == 0:
+            return
+
+        # keep each later value with probability size / seen
+        positions = self.rng.integers(0, self.seen + np.arange(1, len(values) + 1))
+        keep = positions < self.size
+        self.values[positions[keep]] = values[keep]
+        self.seen += len(values)
+
+    def median(self) -> float:
+        return float(np.median(self.values)) if len(self.values) else np.nan
+
+
+class AggState:
+    """
+        Mergeable partial aggregates of one topic (grouped or not).
+    """
+
+    def __init__(self, measures: list, agg: str, group_by=None, categories: dict = None):
+        self.measures = measures
+        self.agg = agg
+        self.group_by = group_by
+        self.categories = categories
+        self.partial = None
+        self.sketches = {}
+
+    def update(self, view: pd.DataFrame):
+        if self.agg == "median":
+            self.update_median(view)
+            return
+
+        stats = AGG_STATS[self.agg]
+        if self.group_by:
+            part = view.groupby(self.group_by, observed=True)[self.measures].agg(stats)
+        else:
+            # one row of partials, measures x stats flattened to columns
+            part = view[self.measures].agg(stats).unstack().to_frame().T
+
+        if self.partial is None:
+            self.partial = part
+        else:
+            merged = pd.concat([self.partial, part])
+            rules = {column: MERGE_STATS[column[1]] for column in merged.columns}
+            if self.group_by:
+                self.partial = merged.groupby(level=list(range(merged.index.nlevels)), observed=True).agg(rules)
+            else:
+                self.partial = merged.agg(rules).to_frame().T
+
+    def update_median(self, view: pd.DataFrame):
+        for m in self.measures:
+            # median needs numeric values, like pandas
+            if not pd.api.types.is_numeric_dtype(view[m]):
+                raise TypeError(f"Could not compute median of non-numeric column '{m}'")
+
+            if self.group_by:
+                for key, values in view.groupby(self.group_by, observed=True)[m]:
+                    self.sketch(key, m).update(values.to_numpy())
+            else:
+                self.sketch(None, m).update(view[m].to_numpy())
+
+    def sketch(self, key, measure) -> MedianSketch:
+        if (key, measure) not in self.sketches:
+            self.sketches[(key, measure)] = MedianSketch()
+        return self.sketches[(key, measure)]
+
+    def result(self):
+        if self.agg == "median":
+            return self.median_result()
+
+        if self.partial is None:
+            raise ValueError("No rows matched the topic")
+
+        values = {}
+        for m in self.measures:
+            if self.agg == "mean":
+                count = self.partial[(m, "count")]
+                values[m] = self.partial[(m, "sum")] / count.where(count > 0)
+            else:
+                values[m] = self.partial[(m, AGG_STATS[self.agg][0])]
+
+        if not self.group_by:
+            # same shape as df[measures].agg(agg): a Series indexed by measure
+            return pd.Series({m: values[m].iloc[0] for m in self.measures})
+
+        result = pd.DataFrame(values)
+        return self.with_categories(result)
+
+    def median_result(self):
+        if not self.group_by:
+            return pd.Series({m: self.sketch(None, m).median() for m in self.measures})
+
+        keys = sorted({key for key, _ in self.sketches})
+        if isinstance(self.group_by, list):
+            index = pd.MultiIndex.from_tuples(keys, names=self.group_by)
+        else:
+            index = pd.Index(keys, name=self.group_by)
+
+        result = pd.DataFrame(
+            {m: [self.sketches[(key, m)].median() if (key, m) in self.sketches else np.nan for key in keys]
+             for m in self.measures},
+            index=index
+        )
+        return self.with_categories(result)
+
+    def with_categories(self, result: pd.DataFrame) -> pd.DataFrame:
+        # ordered categories (months) list every category, like the in-memory path
+        if self.categories is None:
+            return result
+
+        index = pd.CategoricalIndex(self.categories, categories=self.categories,
+                                    ordered=True, name=self.group_by)
+        result = result.reindex(index)
+        if self.agg in ("sum", "count"):
+            result = result.fillna(0)
+        return result
+
+
+class CorrState:
+    """
+        Pairwise running sums for Pearson correlation, shifted by the first
+        chunk's means to limit cancellation.
+    """
+
+    def __init__(self, measures: list):
+        self.measures = measures
+        self.shift = None
+        self.sums = {}
+
+    def update(self, view: pd.DataFrame):
+        data = view[self.measures]
+        for m in self.measures:
+            # correlation needs numeric values, like pandas
+            if not pd.api.types.is_numeric_dtype(data[m]):
+                raise TypeError(f"Could not correlate non-numeric column '{m}'")
+
+        data = data.astype(float)
+        if self.shift is None:
+            self.shift = data.mean().fillna(0)
+        data = data - self.shift
+
+        for i, a in enumerate(self.measures):
+            for b in self.measures[i:]:
+                x, y = data[a].to_numpy(), data[b].to_numpy()
+                both = ~(np.isnan(x) | np.isnan(y))
+                x, y = x[both], y[both]
+
+                sums = self.sums.setdefault((a, b), np.zeros(6))
+                sums += [len(x), x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum()]
+
+    def result(self) -> dict:
+        result = {a: {} for a in self.measures}
+        for a in self.measures:
+            for b in self.measures:
+                pair = (a, b) if (a, b) in self.sums else (b, a)
+                n, sx, sy, sxx, syy, sxy = self.sums.get(pair, np.zeros(6))
+
+                cov = n * sxy - sx * sy
+                var_x = n * sxx - sx * sx
+                var_y = n * syy - sy * sy
+                if n < 2 or var_x <= 0 or var_y <= 0:
+                    value = np.nan
+                elif a == b:
+                    value = 1.0
+                else:
+                    value = float(np.clip(cov / np.sqrt(var_x * var_y), -1, 1))
+                result[b][a] = value
+        return result
+
+
+# build the streaming state of a topic, None if it cannot run out of core
+def topic_state(topic: dict, sample: pd.DataFrame):
+    item = topic["item"]
+    agg = item.get("aggregation")
+    measures = topic["measures"]
+
+    if topic["kind"] == "correlation":
+        return CorrState(measures)
+
+    if topic["kind"] not in ("group_agg", "agg"):
+        return None
+
+    if not isinstance(agg, str) or agg not in SUPPORTED_AGGS:
+        raise ValueError(f"Unsupported aggregation '{agg}' in large-file mode")
+    if not isinstance(measures, list) or not all(m in sample.columns for m in measures):
+        raise KeyError(f"Unknown measure {measures}")
+
+    group_by = item.get("group_by") if topic["kind"] == "group_agg" else None
+    categories = None
+    if group_by:
+        cols = group_by if isinstance(group_by, list) else [group_by]
+        if not all(c in sample.columns for c in cols):
+            raise KeyError(f"Unknown group_by {group_by}")
+        if not observed_groups(sample, group_by) and not isinstance(group_by, list):
+            categories = list(sample[group_by].cat.categories)
+
+    return AggState(measures, agg, group_by, categories)
+
+# stream the stored csv chunk by chunk, converted like the profiled sample
+def iter_chunks(source: dict, type_report: dict):
+    reader = pd.read_csv(source["path"], encoding=source["encoding"], chunksize=LARGE_CHUNK_ROWS)
+    with reader:
+        for chunk in reader:
+            yield apply_column_types(chunk, type_report)
+
+# analyze intents over a large file with bounded memory, same output as analyze_intent
+def analyze_intent_chunked(sample: pd.DataFrame, source: dict, type_report: dict,
+                           response: str, explain: dict = None, on_result=None) -> str:
+    data = try_parse_json(response)
+
+    # plan against the profiled sample, executed over every chunk
+    plan = compile_plan(sample, data)
+
+    states = {}
+    topic_seconds = {}
+    for topic in plan["topics"]:
+        try:
+            state = topic_state(topic, sample)
+            if state is not None:
+                states[topic["index"]] = state
+        except Exception as e:
+            logger.warning("Error processing topic '%s': %s", topic['item'].get('topic'), e)
+            FAILED_TOPICS.inc(kind=topic["kind"])
+
+    rows = 0
+    for chunk in iter_chunks(source, type_report):
+        rows += len(chunk)
+        masks = {}
+
+        for topic in plan["topics"]:
+            state = states.get(topic["index"])
+            if state is None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                # filters are applied per chunk, one mask per distinct filter set
+                filter_key = topic["filter_key"]
+                if filter_key is None:
+                    view = chunk
+                else:
+                    if filter_key not in masks:
+                        masks[filter_key] = build_mask(chunk, plan["filters"][filter_key])
+                    view = chunk[masks[filter_key]]
+
+                state.update(view)
+            except Exception as e:
+                # skip the topic for the rest of the file
+                logger.warning("Error processing topic '%s': %s", topic['item'].get('topic'), e)
+                FAILED_TOPICS.inc(kind=topic["kind"])
+                states.pop(topic["index"], None)
+            finally:
+                topic_seconds[topic["index"]] = topic_seconds.get(topic["index"], 0) + time.perf_counter() - start
+
+    result_list = []
+    for topic in plan["topics"]:
+        state = states.get(topic["index"])
+        if state is None:
+            continue
+
+        item = topic["item"]
+        try:
+            if isinstance(state, CorrState):
+                result_list.append({
+                    "topic": item.get("topic"),
+                    "relationship": item.get("relationship"),
+                    "result": state.result()
+                })
+            else:
+                result_list.append(finalize_result(item, state.result()))
+            # every topic completes with the last chunk
+            if on_result is not None:
+                on_result(topic["index"], result_list[-1])
+        except Exception as e:
+            logger.warning("Error processing topic '%s': %s", item.get('topic'), e)
+            FAILED_TOPICS.inc(kind=topic["kind"])
+        finally:
+            TOPIC_SECONDS.observe(topic_seconds.get(topic["index"], 0), kind=topic["kind"])
+
+    if explain is not None:
+        explain.update(explain_plan(plan))
+        explain["rows"] = rows
+        explain["mode"] = "chunked"
+        explain["topic_seconds"] = [round(topic_seconds.get(t["index"], 0), 6) for t in plan["topics"]]
+
+    if len(result_list) == 0:
+        return None
+
+    return json.dumps(result_list)
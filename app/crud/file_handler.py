@@ -1,15 +1,49 @@
 from fastapi import UploadFile
 
+import asyncio
+import logging
 import uuid
 import pandas as pd
 from collections import Counter
 from io import StringIO, BytesIO
-from app.utils.config import TEMP_DICT, RES_DICT, DURATION
+import json
+from app.utils.config import SESSION_STORE
+from app.utils.metrics import UPLOADS
+from app.utils.env import (MAX_ROWS, MAX_COLUMNS, MAX_UPLOAD_BYTES, LARGE_FILE_MODE,
+                           LARGE_FILE_DIR, LARGE_FILE_MAX_BYTES, LARGE_SAMPLE_ROWS,
+                           PARSE_WORKERS, EXCEL_ENGINE)
 
 import calendar
+import codecs
+import hashlib
+import os
+import shutil
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pandas.tseries.api import guess_datetime_format
+
+logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = [".csv", ".xls", ".xlsx"]
 
+# ingestion settings
+CSV_CHUNK_ROWS = 5000
+ENCODING_SAMPLE_BYTES = 64 * 1024
+HASH_BLOCK_BYTES = 1024 * 1024
+
+# uploads are parsed here so a long parse does not block the event loop
+parse_pool = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+
+# type inference settings
+TYPE_SAMPLE_SIZE = 1000
+DATE_FORMAT_CANDIDATES = 20
+# share of a sample that must parse for a column to be a date
+DATE_PARSE_THRESHOLD = 0.8
+
+# compaction settings
+CATEGORY_MAX_RATIO = 0.5
+
 # Get list of month names
 full_months = list(calendar.month_name)[1:] # [January, February...]
 short_months = list(calendar.month_abbr)[1:] # [Jan, Feb...]
@@ -18,88 +52,508 @@ short_months = list(calendar.month_abbr)[1:] # [Jan, Feb...]
 def validate_file(filename : str) -> bool:
     return any(filename.endswith(ext) for ext in ALLOWED_EXTENSIONS)
 
-# read and validate file
-async def read_validate_file(file: UploadFile) -> str:
-    contents = await file.read()
+# detect text encoding from the first bytes of the upload
+def detect_encoding(sample : bytes) -> str:
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
 
-    if file.filename.endswith('.csv'):
-        df = pd.read_csv(StringIO(contents.decode('utf-8')))
-    else:
-        df = pd.read_excel(BytesIO(contents))
+    # incremental decoder tolerates a multi-byte char cut at the sample end
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1252"
 
-    # if there is no enough columns
-    if df.shape[1] < 2:
+# size of the spooled upload without reading it into memory
+def upload_size(fileobj) -> int:
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+# content hash of the spooled upload, the dataset key shared by identical uploads
+# (salt separates datasets read differently from the same bytes, e.g. another sheet)
+def content_hash(fileobj, salt : str = "") -> str:
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    while True:
+        block = fileobj.read(HASH_BLOCK_BYTES)
+        if not block:
+            break
+        digest.update(block)
+    fileobj.seek(0)
+    digest.update(salt.encode("utf-8"))
+    return digest.hexdigest()
+
+# excel reader engine, calamine (rust) is much faster than openpyxl when installed
+def excel_engine() -> str:
+    if EXCEL_ENGINE != "auto":
+        return EXCEL_ENGINE or None
+    try:
+        import python_calamine
+        return "calamine"
+    except ImportError:
         return None
-    
+
+EXCEL_READER = excel_engine()
+
+# sheet to read from the form value, a sheet name or a position (first sheet by default)
+def sheet_name(sheet : str = None):
+    if sheet is None or not str(sheet).strip():
+        return 0
+    sheet = str(sheet).strip()
+    return int(sheet) if sheet.isdigit() else sheet
+
+# read only the selected sheet, up to one row past the limit
+def read_excel_limited(fileobj, sheet = 0) -> pd.DataFrame:
+    return pd.read_excel(fileobj, sheet_name=sheet, nrows=MAX_ROWS + 1, engine=EXCEL_READER)
+
+# validate dataframe header against limits
+def valid_header(df : pd.DataFrame) -> bool:
+    # if there is no enough columns or too many
+    if df.shape[1] < 2 or df.shape[1] > MAX_COLUMNS:
+        return False
+
     # if there is missing header
-    if df.columns.str.contains("Unnamed").any():
+    if df.columns.astype(str).str.contains("Unnamed").any():
+        return False
+
+    return True
+
+# columns parsed as numbers in one chunk and text in another
+def conflicting_columns(chunks : list) -> list:
+    if len(chunks) < 2:
+        return []
+
+    conflicting = []
+    for col in chunks[0].columns:
+        has_object = any(pd.api.types.is_object_dtype(chunk[col]) for chunk in chunks)
+        has_other = any(not pd.api.types.is_object_dtype(chunk[col]) for chunk in chunks)
+        if has_object and has_other:
+            conflicting.append(col)
+    return conflicting
+
+# re-read conflicting columns as the text in the file, like a single read of a text column
+# (stringifying the parsed chunks would turn 1 into "1.0")
+def read_text_columns(fileobj, encoding : str, df : pd.DataFrame, columns : list) -> pd.DataFrame:
+    positions = sorted(df.columns.get_loc(col) for col in columns)
+    fileobj.seek(0)
+    text = pd.read_csv(fileobj, encoding=encoding, usecols=positions, dtype=str, nrows=len(df))
+    for position, values in zip(positions, text.columns):
+        df[df.columns[position]] = text[values].to_numpy(dtype=object)
+    return df
+
+# raised when a csv has more rows than MAX_ROWS
+class RowLimitExceeded(Exception):
+    pass
+
+# stream csv in chunks, abort as soon as a limit is crossed
+def read_csv_limited(fileobj) -> pd.DataFrame:
+    encoding = detect_encoding(fileobj.read(ENCODING_SAMPLE_BYTES))
+    fileobj.seek(0)
+
+    chunks = []
+    rows = 0
+
+    # nrows stops the parser one row past the limit
+    reader = pd.read_csv(fileobj, encoding=encoding, chunksize=CSV_CHUNK_ROWS, nrows=MAX_ROWS + 1)
+    with reader:
+        for chunk in reader:
+            # validate header on the first chunk
+            if not chunks and not valid_header(chunk):
+                return None
+
+            rows += len(chunk)
+            # dataset exceeds limit
+            if rows > MAX_ROWS:
+                raise RowLimitExceeded()
+
+            chunks.append(chunk)
+
+    if not chunks:
+        return None
+
+    conflicting = conflicting_columns(chunks)
+    df = pd.concat(chunks, ignore_index=True)
+    if conflicting:
+        df = read_text_columns(fileobj, encoding, df, conflicting)
+    return df
+
+# path of a large upload kept on disk, named by dataset key
+def large_file_path(key : str) -> str:
+    return os.path.join(LARGE_FILE_DIR, f"{key}.csv")
+
+# keep a large csv on disk and store a sample for profiling
+def store_large_file(fileobj, size : int, key : str) -> str:
+    encoding = detect_encoding(fileobj.read(ENCODING_SAMPLE_BYTES))
+    fileobj.seek(0)
+
+    sample = pd.read_csv(fileobj, encoding=encoding, nrows=LARGE_SAMPLE_ROWS)
+    if not valid_header(sample) or sample.dropna(how='all').shape[0] < 2:
+        return None
+
+    clean_id = str(uuid.uuid4())
+    path = large_file_path(key)
+
+    # copy the spooled upload to disk in blocks and estimate the row count
+    os.makedirs(LARGE_FILE_DIR, exist_ok=True)
+    fileobj.seek(0)
+    lines = 0
+    with open(path, "wb") as out:
+        while True:
+            block = fileobj.read(1024 * 1024)
+            if not block:
+                break
+            lines += block.count(b"\n")
+            out.write(block)
+
+    SESSION_STORE.create(clean_id, sample, key=key)
+    SESSION_STORE.update(clean_id, source={
+        "path": path,
+        "encoding": encoding,
+        "bytes": size,
+        "estimated_rows": max(lines - 1, len(sample))
+    })
+    return clean_id
+
+# drop the on-disk copy of a large upload with its dataset
+def remove_large_file(key : str):
+    try:
+        os.remove(large_file_path(key))
+    except (OSError, TypeError):
+        pass
+
+SESSION_STORE.on_evict(remove_large_file)
+
+# give a forked dataset its own link to the large upload, it is removed with that dataset
+def fork_large_file(path : str, key : str) -> str:
+    fork_path = large_file_path(key)
+    if path == fork_path:
+        return path
+
+    try:
+        os.link(path, fork_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(path, fork_path)
+    return fork_path
+
+# read and validate file on the parse pool, the event loop keeps serving other requests
+async def read_validate_file(file: UploadFile, sheet : str = None) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(parse_pool, parse_upload, file.file, file.filename, sheet)
+
+# parse, validate and store a spooled upload, returns the new session id
+def parse_upload(fileobj, filename : str, sheet : str = None) -> str:
+    size = upload_size(fileobj)
+    is_csv = filename.lower().endswith('.csv')
+
+    # reject oversized uploads before parsing
+    if size > MAX_UPLOAD_BYTES and not (LARGE_FILE_MODE and is_csv and size <= LARGE_FILE_MAX_BYTES):
         return None
-    
+
+    # identical uploads share the stored dataset and its analysis
+    sheet = None if is_csv else sheet_name(sheet)
+    key = content_hash(fileobj, salt="" if is_csv else f"sheet:{sheet}")
+    clean_id = str(uuid.uuid4())
+    if SESSION_STORE.link(clean_id, key):
+        UPLOADS.inc(result="shared")
+        return clean_id
+
+    if size > MAX_UPLOAD_BYTES:
+        return stored(store_large_file(fileobj, size, key))
+
+    if is_csv:
+        try:
+            df = read_csv_limited(fileobj)
+        except RowLimitExceeded:
+            # too many rows for memory, aggregate chunk by chunk instead
+            if LARGE_FILE_MODE:
+                return stored(store_large_file(fileobj, size, key))
+            return None
+
+        if df is None:
+            return None
+    else:
+        df = read_excel_limited(fileobj, sheet)
+
+        if not valid_header(df):
+            return None
+
+        # dataset exceeds limit
+        if df.shape[0] > MAX_ROWS:
+            return None
+
     # if there is no enough rows
     if df.dropna(how='all').shape[0] < 2:
         return None
-    
-    # dataset exceeds limit
-    if df.shape[0] > 25000:
-        return None
 
     # store data to server dict
-    clean_id = str(uuid.uuid4())
+    SESSION_STORE.create(clean_id, df, key=key)
+    return stored(clean_id)
 
-    TEMP_DICT[clean_id] = df
+# count a newly stored upload
+def stored(clean_id : str) -> str:
+    if clean_id is not None:
+        UPLOADS.inc(result="new")
     return clean_id
 
 
 # load file
 def load_file(clean_id : str) -> pd.DataFrame:
-    return TEMP_DICT.get(clean_id)
+    return SESSION_STORE.get_df(clean_id)
+
+
+# bounded sample of a column (nulls included so ratios match the full column)
+def sample_column(series : pd.Series) -> pd.Series:
+    if len(series) > TYPE_SAMPLE_SIZE:
+        return series.sample(TYPE_SAMPLE_SIZE, random_state=0)
+    return series
+
+# formats guessed from the first values of a sample, month first and day first
+# (pandas warns when a guess contradicts dayfirst, expected here as both orders are probed)
+def date_format_candidates(sample : pd.Series) -> list:
+    candidates = []
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Parsing dates in .* format when dayfirst", category=UserWarning)
+        for value in sample.dropna().astype(str).head(DATE_FORMAT_CANDIDATES):
+            for dayfirst in (False, True):
+                fmt = guess_datetime_format(value.strip(), dayfirst=dayfirst)
+                if fmt and fmt not in candidates:
+                    candidates.append(fmt)
+    return candidates
+
+# the candidate format parsing most of the sample, None if none parses enough of it
+def guess_date_format(sample : pd.Series) -> str:
+    best, best_ratio = None, 0
+    for fmt in date_format_candidates(sample):
+        ratio = pd.to_datetime(sample, format=fmt, errors='coerce').notna().mean()
+        if ratio > best_ratio:
+            best, best_ratio = fmt, ratio
+    return best if best_ratio > DATE_PARSE_THRESHOLD else None
+
+# decide column type from a sample, returns (type, datetime format)
+# uniques and nulls are passed when already known by the profiler
+def infer_column_type(series : pd.Series, uniques : list = None, has_nulls : bool = None) -> tuple:
+    sample = sample_column(series)
+
+    # Try numeric conversion first
+    if pd.to_numeric(sample, errors='coerce').notna().mean() > 0.8:
+        return "numeric", None
+
+    # If month name is provided but in object (checked on unique values)
+    if has_nulls is None:
+        has_nulls = series.isna().any()
+    if not has_nulls:
+        if uniques is None:
+            uniques = series.unique()
+        if pd.Series(uniques, dtype=object).str.title().isin(full_months + short_months).all():
+            return "month", None
+
+    # Try datetime conversion with one format checked against the whole sample
+    fmt = guess_date_format(sample)
+    if fmt is not None:
+        return "datetime", fmt
+
+    # no single format fits, per-element parsing is the last resort
+    # it is slow, so reject free text on a few values first
+    head = sample.head(DATE_FORMAT_CANDIDATES)
+    if pd.to_datetime(head, format="mixed", errors='coerce').notna().mean() <= DATE_PARSE_THRESHOLD:
+        return "string", None
+
+    if pd.to_datetime(sample, format="mixed", errors='coerce').notna().mean() > DATE_PARSE_THRESHOLD:
+        return "datetime", "mixed"
+
+    # Otherwise treat as string
+    return "string", None
 
+# strip and title-case strings once per distinct value
+def to_title_strings(series : pd.Series) -> pd.Series:
+    codes, uniques = pd.factorize(series)
+    if len(uniques) == 0:
+        return series
 
-# micro clean dataframe
-def micro_clean(df : pd.DataFrame) -> pd.DataFrame:
+    titled = pd.Index(uniques).astype(str).str.strip().str.title()
+    values = pd.Series(titled.take(codes), index=series.index, dtype=object)
+
+    # keep nulls as they were
+    return values.where(codes != -1, series)
+
+# micro clean dataframe, per column decisions are written to report if given
+# type decisions are taken from profile (profiler.profile_df) when given
+def micro_clean(df : pd.DataFrame, report : dict = None, profile : dict = None) -> pd.DataFrame:
     # format column naming convention
     df.columns = df.columns.astype(str).str.strip().str.replace(" ","_").str.lower()
 
     # remove duplicates and null
     df = df.drop_duplicates().dropna(how='all')
 
-    for col in df.columns:
-        df_check = df[df[col].notna()][col]
-        
+    for col in list(df.columns):
+        start = time.perf_counter()
+        col_type, fmt = None, None
+
         if pd.api.types.is_object_dtype(df[col]):
+            if profile and col in profile and "type" in profile[col]:
+                col_type, fmt = profile[col]["type"], profile[col]["format"]
+            else:
+                col_type, fmt = infer_column_type(df[col])
 
-            # Try numeric conversion first
-            numeric_col = pd.to_numeric(df[col], errors='coerce')
-            if numeric_col.notna().mean() > 0.8:
-                df[col] = numeric_col.round(2)
-                continue
-
-            # If month name is provided but in object
-            if df[col].str.title().isin(full_months + short_months).all():
-                month_col = to_month(df[col].str.strip().str.title())
-                df[col] = month_col
-                continue
-
-            # Try datetime conversion
-            datetime_col = pd.to_datetime(df[col], errors='coerce')
-            if datetime_col.notna().mean() > 0.8:
+            if col_type == "numeric":
+                df[col] = pd.to_numeric(df[col], errors='coerce').round(2)
+
+            elif col_type == "month":
+                df[col] = to_month(df[col].str.strip().str.title())
+
+            elif col_type == "datetime":
+                datetime_col = pd.to_datetime(df[col], format=fmt, errors='coerce')
                 df[col+'_year'] = datetime_col.dt.year.fillna(0).astype(int)
                 df[col+'_month'] = datetime_col.dt.month.fillna(0).astype(int)
                 df[col+'_weekday'] = datetime_col.dt.weekday.fillna(0).astype(int)
 
                 df[col] = datetime_col
-            
-            # Otherwise treat as string
-            df[col] = df[col].apply(
-                lambda x: str(x).strip().title() if pd.notnull(x) else x
-            )
+
+            else:
+                df[col] = to_title_strings(df[col])
 
         # Already numeric columns (int/float) → round floats
         elif pd.api.types.is_float_dtype(df[col]):
+            col_type = "numeric"
             df[col] = df[col].round(2)
 
+        if report is not None:
+            report[col] = {
+                "type": col_type or str(df[col].dtype),
+                "format": fmt,
+                "seconds": round(time.perf_counter() - start, 6)
+            }
+            if col_type == "month" and isinstance(df[col].dtype, pd.CategoricalDtype):
+                report[col]["categories"] = list(df[col].cat.categories)
+
     return df
 
+# clean a chunk with the column decisions taken by micro_clean on a sample
+def apply_column_types(df : pd.DataFrame, report : dict) -> pd.DataFrame:
+    # format column naming convention
+    df.columns = df.columns.astype(str).str.strip().str.replace(" ","_").str.lower()
+
+    # duplicates are only removed within the chunk
+    df = df.drop_duplicates().dropna(how='all')
+
+    for col, decision in report.items():
+        if col not in df.columns:
+            continue
+        col_type = decision["type"]
+
+        if col_type == "month":
+            values = df[col].astype(str).str.strip().str.title()
+            if decision.get("categories"):
+                df[col] = pd.Categorical(values, categories=decision["categories"], ordered=True)
+            else:
+                df[col] = values
+
+        elif col_type == "datetime":
+            datetime_col = pd.to_datetime(df[col], format=decision["format"], errors='coerce')
+            df[col+'_year'] = datetime_col.dt.year.fillna(0).astype(int)
+            df[col+'_month'] = datetime_col.dt.month.fillna(0).astype(int)
+            df[col+'_weekday'] = datetime_col.dt.weekday.fillna(0).astype(int)
+
+            df[col] = datetime_col
+
+        elif col_type == "string":
+            df[col] = to_title_strings(df[col])
+
+        # numeric columns (inferred or already numeric in the sample)
+        elif col_type == "numeric" or pd.api.types.is_numeric_dtype(df[col]) or col_type.startswith(("int", "float")):
+            if not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            if pd.api.types.is_float_dtype(df[col]):
+                df[col] = df[col].round(2)
+
+    return df
+
+# compact dtypes of a cleaned dataframe, before/after bytes are written to report if given
+def compact_df(df : pd.DataFrame, report : dict = None, use_arrow : bool = False) -> pd.DataFrame:
+    before = int(df.memory_usage(deep=True).sum())
+    rows = len(df)
+    arrow_string = arrow_string_dtype() if use_arrow else None
+
+    for col in df.columns:
+        series = df[col]
+
+        # low-cardinality strings → category
+        if pd.api.types.is_object_dtype(series):
+            nunique = series.nunique(dropna=True)
+            if rows and nunique / rows <= CATEGORY_MAX_RATIO:
+                df[col] = series.astype("category")
+            elif arrow_string is not None:
+                df[col] = series.astype(arrow_string)
+
+        # integers (including derived date parts) → smallest lossless type
+        elif pd.api.types.is_integer_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            df[col] = pd.to_numeric(series, downcast="integer")
+
+        # floats → float32 only when no value changes
+        elif pd.api.types.is_float_dtype(series) and series.dtype != "float32":
+            downcast = series.astype("float32")
+            if downcast.astype(series.dtype).equals(series):
+                df[col] = downcast
+
+    if report is not None:
+        after = int(df.memory_usage(deep=True).sum())
+        report.update({
+            "bytes_before": before,
+            "bytes_after": after,
+            "saved_ratio": round(1 - after / before, 4) if before else 0
+        })
+
+    return df
+
+# arrow-backed string dtype when pyarrow is installed
+def arrow_string_dtype():
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pd.StringDtype("pyarrow")
+
+# serve a page of rows (DataTables server-side protocol)
+def paginate_rows(df : pd.DataFrame, start : int = 0, length : int = 10,
+                  search : str = None, order_col : int = None, order_dir : str = "asc") -> dict:
+    total = len(df)
+
+    # filter rows containing the search value in any column
+    if search:
+        mask = pd.Series(False, index=df.index)
+        for col in df.columns:
+            mask |= df[col].astype(str).str.contains(search, case=False, regex=False, na=False)
+        df = df[mask]
+
+    filtered = len(df)
+
+    # sort by the requested column
+    if order_col is not None and 0 <= order_col < len(df.columns):
+        df = df.sort_values(by=df.columns[order_col],
+                            ascending=(order_dir != "desc"),
+                            kind="stable")
+
+    # slice the requested page (length -1 means all rows)
+    if length is None or length < 0:
+        page = df.iloc[start:]
+    else:
+        page = df.iloc[start:start + length]
+
+    # to_json handles NaN and timestamps
+    data = json.loads(page.to_json(orient="values", date_format="iso"))
+
+    return {
+        "recordsTotal": total,
+        "recordsFiltered": filtered,
+        "data": data
+    }
+
 def to_month(df_col):
     if df_col.isin(full_months).any():
         return pd.Categorical(df_col, categories=full_months, ordered=True)
@@ -112,6 +566,6 @@ def to_month(df_col):
 
 def clear_dict(clean_id : str):
     try:
-        del TEMP_DICT[clean_id]
-    except Exception as e:
-        print(e)
\ No newline at end of file
+        SESSION_STORE.delete(clean_id)
+    except Exception:
+        logger.exception("Error clearing session '%s'", clean_id)
\ No newline at end of file
@@ -0,0 +1,571 @@
+import asyncio
+import json
+import logging
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app.crud import charts, file_handler
+from app.crud.chunked import analyze_intent_chunked
+from app.crud.profiler import profile_df
+from app.crud.llm_scheduler import LLMBusy
+from app.crud.openai import (intent_prompt, insight_prompt, system_prompt, generate_prompt_async, analyze_intent,
+                             analyze_insight, combine_results, try_parse_json)
+from app.utils.config import SESSION_STORE
+from app.utils.env import MAX_CONCURRENT_JOBS, USE_ARROW_STRINGS, INSIGHT_TOKEN_BUDGET
+from app.utils.metrics import span, JOB_RESULTS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# job states in pipeline order
+JOB_STATES = ["queued", "cleaning", "intent", "executing", "insight", "done"]
+JOB_FAILED = "failed"
+# failure reason of a job turned away by the LLM scheduler, it can be started again
+JOB_BUSY = "llm_busy"
+# a finished analysis being re-run with edited intents, done again afterwards
+JOB_RERUNNING = "rerunning"
+
+# cap the number of analyses running at the same time
+job_slots = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+
+# /events polls the session store at this interval
+EVENT_POLL_SECONDS = 0.25
+EVENT_KEEPALIVE_SECONDS = 15
+
+# re-runs: most topics per request, and stored topic results kept for reuse per dataset
+RERUN_MAX_TOPICS = 10
+RERUN_CACHE_TOPICS = 50
+
+# keep references so running tasks are not garbage collected
+job_tasks = {}
+
+class JobRunning(Exception):
+    """
+        Raised when a re-run is asked for while the analysis or another re-run is running.
+    """
+
+
+# job state as kept on the session
+def job_record(status: str, error: str = None, retry_after: int = None) -> dict:
+    return {
+        "status": status,
+        "error": error,
+        "retry_after": retry_after,
+        "updated": time.time()
+    }
+
+# update job state, kept on the session so every worker can report it
+def set_status(clean_id: str, status: str, error: str = None, retry_after: int = None):
+    if status in ("done", JOB_FAILED):
+        JOB_RESULTS.inc(status=status, reason=error or "")
+
+    SESSION_STORE.update(clean_id, job=job_record(status, error, retry_after))
+
+# the job of a finished analysis
+def is_done(record: dict) -> bool:
+    job = record.get("job")
+    return job is not None and job["status"] == "done" and record.get("results") is not None
+
+# get job state for the status endpoint
+def get_status(clean_id: str) -> dict:
+    record = SESSION_STORE.get_meta(clean_id)
+    job = record.get("job") if record is not None else None
+    if job is None:
+        return None
+
+    status = job["status"]
+    step = JOB_STATES.index(status) if status in JOB_STATES else None
+
+    return {
+        "status": status,
+        "step": step,
+        "steps": len(JOB_STATES) - 1,
+        "error": job["error"],
+        "retry_after": job.get("retry_after")
+    }
+
+# forget a busy job so the analysis can be started again
+def reset_job(clean_id: str):
+    SESSION_STORE.update(clean_id, job=None)
+
+# enqueue analysis job, does nothing if the job already exists
+# (sessions sharing a dataset share its job, which runs on the dataset key)
+def start_job(clean_id: str) -> bool:
+    key = SESSION_STORE.resolve(clean_id)
+    if key is None:
+        return False
+
+    # claim the job atomically, another request or worker may be starting it too
+    if not SESSION_STORE.update(key, when=lambda record: record.get("job") is None, job=job_record("queued")):
+        return False
+
+    task = asyncio.create_task(run_job(key))
+    job_tasks[key] = task
+    task.add_done_callback(lambda t: job_tasks.pop(key, None))
+
+    return True
+
+# cancel a job running in this worker
+def cancel_job(key: str):
+    task = job_tasks.pop(key, None)
+    if task is not None:
+        # may be called from threadpool routes, schedule on the task's loop
+        task.get_loop().call_soon_threadsafe(task.cancel)
+
+# remove a session, its dataset and job go with the last session sharing them
+def clear_session(clean_id: str):
+    SESSION_STORE.delete(clean_id)
+
+# stop jobs of datasets evicted from the store
+SESSION_STORE.on_evict(cancel_job)
+
+# server-sent events of a job: topics and insights as they arrive, then its final status
+# (reads the session store, so any worker can serve the stream)
+async def job_events(clean_id: str, disconnected):
+    sent = {}
+    last_status = None
+    idle = 0
+
+    while True:
+        record = await run_in_threadpool(SESSION_STORE.get_meta, clean_id)
+        job = record.get("job") if record is not None else None
+        status = job["status"] if job is not None else JOB_FAILED
+
+        for entry in (record or {}).get("stream") or []:
+            if sent.get(entry["index"]) == entry["done"]:
+                continue
+            sent[entry["index"]] = entry["done"]
+            item = entry["item"]
+            yield sse_event("topic", {
+                "index": entry["index"],
+                "topic": item.get("topic"),
+                "insight": item.get("insight"),
+                "done": entry["done"],
+                # drawn as soon as the aggregation is ready, redrawn with the chart type the insight picks
+                "chart": charts.chart_data(item)
+            })
+            idle = 0
+
+        if status != last_status:
+            last_status = status
+            yield sse_event("status", get_status(clean_id) or {"status": JOB_FAILED, "error": "not_found"})
+            idle = 0
+
+        if status in ("done", JOB_FAILED) or await disconnected():
+            return
+
+        # comment line keeps proxies from closing an idle stream
+        idle += 1
+        if idle * EVENT_POLL_SECONDS >= EVENT_KEEPALIVE_SECONDS:
+            yield ": keepalive\n\n"
+            idle = 0
+
+        await asyncio.sleep(EVENT_POLL_SECONDS)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# token usage of a response for the session breakdown
+def usage_of(response) -> dict:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0}
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0
+    }
+
+class TopicStream:
+    """
+        Per-topic insights for one job. Each aggregation that finishes gets its
+        own insight call right away, and topics and insights are written to the
+        session as "stream" entries for /events while the other topics still run.
+    """
+
+    def __init__(self, clean_id: str, start: float, timings: dict, budget: int = INSIGHT_TOKEN_BUDGET):
+        self.clean_id = clean_id
+        self.start = start
+        self.timings = timings
+        self.budget = budget
+        self.entries = {}
+        # (topic index, result, insight task) in completion order
+        self.tasks = []
+        # topic index of each final result, set by results()
+        self.order = []
+        self.lock = asyncio.Lock()
+        # session writes in flight, waited for once the stream is closed
+        self.writes = set()
+        # no new topics once the final results are known, no writes once they are saved
+        self.done = False
+        self.closed = False
+        self.llm_start = None
+
+    # callback for the planner, called from pool threads
+    def callback(self, loop):
+        def on_result(index, result):
+            # the same plain values the final results are built from
+            result = json.loads(json.dumps(result))
+            loop.call_soon_threadsafe(self.add, index, result)
+        return on_result
+
+    def add(self, index: int, result: dict):
+        # late topics (abandoned or finished after the job) get no insight call
+        if self.done:
+            return
+        self.tasks.append((index, result, asyncio.ensure_future(self.insight(index, result))))
+
+    async def insight(self, index: int, result: dict) -> tuple:
+        self.entries[index] = {"index": index, "item": result, "done": False}
+        await self.publish()
+
+        report = {}
+        with span("insight_prompt", self.timings):
+            prompt = await run_in_threadpool(insight_prompt, [result], report, self.budget)
+        if self.llm_start is None:
+            self.llm_start = time.perf_counter()
+        with span("insight_llm"):
+            response = await generate_prompt_async(system_prompt(), prompt, session=self.clean_id)
+
+        insights = analyze_insight(response.choices[0].message.content)
+        combined = combine_results([result], insights[:1] if isinstance(insights, list) and insights else [{}])[0]
+
+        # time to first useful content on the report page
+        if "first_insight" not in self.timings:
+            elapsed = time.perf_counter() - self.start
+            self.timings["first_insight"] = round(elapsed, 6)
+            STAGE_SECONDS.observe(elapsed, stage="first_insight")
+
+        self.entries[index] = {"index": index, "item": combined, "done": True}
+        await self.publish()
+        return combined, usage_of(response), report
+
+    async def publish(self):
+        async with self.lock:
+            if self.closed:
+                return
+            entries = [self.entries[index] for index in sorted(self.entries)]
+            # a cancelled caller must not leave a write that lands after the final save
+            write = asyncio.ensure_future(run_in_threadpool(SESSION_STORE.update, self.clean_id, stream=entries))
+            self.writes.add(write)
+            write.add_done_callback(self.writes.discard)
+            await asyncio.shield(write)
+
+    # combined results in final order, with summed insight usage and merged compaction reports
+    async def results(self, final: list) -> tuple:
+        # let callbacks of the last topics run
+        await asyncio.sleep(0)
+        self.done = True
+
+        pending = sorted(self.tasks, key=lambda task: task[0])
+        matched = []
+        for result in final:
+            task = next((task for task in pending if task[1] == result), None)
+            if task is None:
+                index = max(self.entries, default=-1) + 1
+                task = (index, result, asyncio.ensure_future(self.insight(index, result)))
+            else:
+                pending.remove(task)
+            matched.append(task[2])
+            self.order.append(task[0])
+
+        # topics left out of the final results (timed out) are not waited for
+        for _, _, task in pending:
+            task.cancel()
+
+        outcomes = await asyncio.gather(*matched)
+        self.closed = True
+        await asyncio.gather(*self.writes, return_exceptions=True)
+        if self.llm_start is not None:
+            self.timings["insight_llm"] = round(time.perf_counter() - self.llm_start, 6)
+
+        tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+        truncation = {"budget": self.budget, "tokens_before": 0, "tokens_after": 0, "topics": []}
+        for _, usage, report in outcomes:
+            for key in tokens:
+                tokens[key] += usage[key]
+            truncation["tokens_before"] += report.get("tokens_before", 0)
+            truncation["tokens_after"] += report.get("tokens_after", 0)
+            truncation["topics"].extend(report.get("topics", []))
+
+        return [combined for combined, _, _ in outcomes], tokens, truncation
+
+    def cancel(self):
+        self.done = True
+        self.closed = True
+        for _, _, task in self.tasks:
+            task.cancel()
+
+# run the full analysis pipeline
+async def run_job(clean_id: str):
+    async with job_slots:
+        # set timer once the job leaves the queue
+        start = time.perf_counter()
+
+        record = SESSION_STORE.get(clean_id)
+        if record is None:
+            set_status(clean_id, JOB_FAILED, "not_found")
+            return
+
+        df = record["df"]
+        # large uploads keep the full csv on disk, df is only a sample
+        source = record.get("source")
+        # parse time recorded by the upload
+        timings = dict(record.get("timings") or {})
+        tokens = {}
+        stream = None
+
+        try:
+            # micro clean dataframe (cpu-bound, keep it off the event loop)
+            set_status(clean_id, "cleaning")
+
+            # one profiling pass per upload, cached on the session
+            profile = record.get("profile")
+            if profile is None:
+                with span("profiling", timings):
+                    profile = await run_in_threadpool(profile_df, df)
+                await run_in_threadpool(SESSION_STORE.update, clean_id, profile=profile)
+
+            type_report = {}
+            with span("cleaning", timings):
+                processed_df = await run_in_threadpool(file_handler.micro_clean, df, type_report, profile)
+
+            # compact dtypes before the dataframe is cached
+            compaction = {}
+            with span("compaction", timings):
+                processed_df = await run_in_threadpool(file_handler.compact_df, processed_df, compaction, USE_ARROW_STRINGS)
+
+            # generate intent
+            set_status(clean_id, "intent")
+            with span("intent_prompt", timings):
+                prompt = await run_in_threadpool(intent_prompt, processed_df,
+                                                 source["estimated_rows"] if source else None, profile)
+            with span("intent_llm", timings):
+                intent = await generate_prompt_async(system_prompt(), prompt, session=clean_id)
+            tokens["intent"] = usage_of(intent)
+
+            set_status(clean_id, "executing")
+            content = intent.choices[0].message.content
+            intents = try_parse_json(content)
+            # the insight budget is shared by the topics, each gets its own prompt
+            topic_count = max(len(intents), 1)
+            stream = TopicStream(clean_id, start, timings, budget=INSIGHT_TOKEN_BUDGET // topic_count)
+            on_result = stream.callback(asyncio.get_running_loop())
+            plan = {}
+            with span("execution", timings):
+                if source:
+                    # aggregate the file chunk by chunk with the sample's column types
+                    intent_res = await run_in_threadpool(analyze_intent_chunked, processed_df, source, type_report,
+                                                         content, plan, on_result)
+                else:
+                    intent_res = await run_in_threadpool(analyze_intent, processed_df, content, plan, on_result)
+
+            if intent_res is None:
+                set_status(clean_id, JOB_FAILED, "analysis_failed")
+                return
+
+            # insights were requested per topic as each aggregation finished
+            set_status(clean_id, "insight")
+            combined_results, tokens["insight"], truncation = await stream.results(try_parse_json(intent_res))
+            topics = topic_cache(intents, stream.order, combined_results)
+
+            end = time.perf_counter()
+            duration = end - start
+
+            # save to session store, session may have expired meanwhile
+            saved = await run_in_threadpool(SESSION_STORE.update, clean_id,
+                                            df=processed_df, #update to processed df
+                                            results=combined_results,
+                                            duration=duration,
+                                            type_report=type_report,
+                                            plan=plan,
+                                            compaction=compaction,
+                                            timings=timings,
+                                            tokens=tokens,
+                                            truncation=truncation,
+                                            intents=intents if isinstance(intents, list) else [],
+                                            topics=topics,
+                                            stream=None)
+            if not saved:
+                set_status(clean_id, JOB_FAILED, "session_expired")
+                return
+
+            set_status(clean_id, "done")
+
+        except asyncio.CancelledError:
+            raise
+
+        except LLMBusy as e:
+            set_status(clean_id, JOB_FAILED, JOB_BUSY, retry_after=e.retry_after)
+
+        except Exception:
+            logger.exception("Error during analysis of '%s'", clean_id)
+            set_status(clean_id, JOB_FAILED, "analysis_failed")
+
+        finally:
+            # insight calls still in flight when the job ends early
+            if stream is not None:
+                stream.cancel()
+
+# cache key of an intent, equal for intents that would compute the same topic
+def intent_key(item: dict) -> str:
+    return json.dumps(item, sort_keys=True, default=str)
+
+# stored results by intent, merged into previous ones (newest last)
+def topic_cache(intents: list, order: list, results: list, previous: dict = None) -> dict:
+    topics = dict(previous or {})
+    if isinstance(intents, list):
+        for index, combined in zip(order, results):
+            if 0 <= index < len(intents):
+                key = intent_key(intents[index])
+                topics.pop(key, None)
+                topics[key] = combined
+    return topics
+
+# move the topics in use to the end and drop the oldest others beyond the cache size
+def trim_topics(topics: dict, intents: list) -> dict:
+    for item in intents:
+        key = intent_key(item)
+        if key in topics:
+            topics[key] = topics.pop(key)
+
+    while len(topics) > RERUN_CACHE_TOPICS:
+        topics.pop(next(iter(topics)))
+    return topics
+
+# check the intents sent for a re-run, raises ValueError with a message for the client
+def validate_intents(intents) -> list:
+    if not isinstance(intents, list) or not intents:
+        raise ValueError("Expected a non-empty list of intents.")
+    if len(intents) > RERUN_MAX_TOPICS:
+        raise ValueError(f"At most {RERUN_MAX_TOPICS} intents can be analyzed at once.")
+    for item in intents:
+        if not isinstance(item, dict) or not isinstance(item.get("topic"), str) or not item["topic"].strip():
+            raise ValueError("Every intent needs a topic.")
+    return intents
+
+# re-run a finished analysis with edited intents, without the intent LLM call:
+# unchanged topics keep their stored result and insight, new or edited ones
+# are aggregated on the cleaned dataframe and get their own insight call
+async def rerun_job(clean_id: str, intents: list) -> dict:
+    intents = validate_intents(intents)
+    start = time.perf_counter()
+
+    record = await run_in_threadpool(SESSION_STORE.get_meta, clean_id)
+    if record is None:
+        return None
+    if not is_done(record):
+        raise JobRunning()
+
+    # claim the job before forking, a re-run turned away leaves nothing behind
+    # (sessions sharing the dataset wait for the fork like for any running job)
+    shared = await run_in_threadpool(SESSION_STORE.resolve, clean_id)
+    if shared is None:
+        return None
+    previous = record["job"]
+    claimed = await run_in_threadpool(SESSION_STORE.update, shared, when=is_done, job=job_record(JOB_RERUNNING))
+    if not claimed:
+        raise JobRunning()
+
+    key = None
+    job = job_record("done")
+    try:
+        # edited results go to the session's own dataset, the uploaded one keeps the original report
+        # (a large upload gets its own link to the csv first, the uploaded one may go with the fork)
+        source = record.get("source")
+        if source:
+            source = dict(source, path=await run_in_threadpool(file_handler.fork_large_file, source["path"], clean_id))
+        key = await run_in_threadpool(SESSION_STORE.fork, clean_id)
+        if key is None:
+            return None
+
+        return await rerun_topics(key, intents, source, start)
+
+    except LLMBusy as e:
+        job = job_record("done", JOB_BUSY, e.retry_after)
+        raise
+
+    # none of the intents fit the data, the client is told why
+    except ValueError:
+        raise
+
+    except Exception:
+        logger.exception("Error during re-run of '%s'", clean_id)
+        job = job_record("done", "analysis_failed")
+        raise
+
+    finally:
+        # the uploaded dataset gets its job back once the session has left it,
+        # the last complete report stays in place whatever happened
+        if key != shared:
+            SESSION_STORE.update(shared, job=previous)
+        if key is None and record.get("source"):
+            file_handler.remove_large_file(clean_id)
+        if key is not None:
+            SESSION_STORE.update(key, job=job)
+
+async def rerun_topics(key: str, intents: list, source: dict, start: float) -> dict:
+    record = await run_in_threadpool(SESSION_STORE.get, key)
+    if record is None:
+        return None
+
+    cache = record.get("topics") or {}
+    keys = list(dict.fromkeys(intent_key(item) for item in intents))
+    changed = list({intent_key(item): item for item in intents if intent_key(item) not in cache}.values())
+
+    timings = {}
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+    topics = cache
+    stream = None
+
+    try:
+        if changed:
+            stream = TopicStream(key, start, timings, budget=INSIGHT_TOKEN_BUDGET // len(keys))
+            on_result = stream.callback(asyncio.get_running_loop())
+            content = json.dumps(changed)
+
+            with span("rerun_execution", timings):
+                if source:
+                    intent_res = await run_in_threadpool(analyze_intent_chunked, record["df"], source,
+                                                         record.get("type_report") or {}, content, None, on_result)
+                else:
+                    intent_res = await run_in_threadpool(analyze_intent, record["df"], content, None, on_result)
+
+            if intent_res is not None:
+                combined_results, tokens, _ = await stream.results(try_parse_json(intent_res))
+                topics = topic_cache(changed, stream.order, combined_results, cache)
+    finally:
+        if stream is not None:
+            stream.cancel()
+
+    results = [topics[intent_key(item)] for item in intents if intent_key(item) in topics]
+    if not results:
+        raise ValueError("None of the intents could be analyzed on this dataset.")
+
+    # counted per distinct intent, repeated ones are computed once
+    reused = sum(1 for item_key in keys if item_key in cache)
+    computed = sum(1 for item_key in keys if item_key not in cache and item_key in topics)
+    topics = trim_topics(dict(topics), intents)
+
+    duration = time.perf_counter() - start
+    timings["rerun"] = round(duration, 6)
+    STAGE_SECONDS.observe(duration, stage="rerun")
+
+    saved = await run_in_threadpool(SESSION_STORE.update, key,
+                                    results=results,
+                                    intents=intents,
+                                    topics=topics,
+                                    duration=duration,
+                                    source=source,
+                                    timings=dict(record.get("timings") or {}, **timings),
+                                    tokens=dict(record.get("tokens") or {}, rerun=tokens),
+                                    stream=None)
+    if not saved:
+        return None
+
+    return {
+        "results": results,
+        "reused": reused,
+        "computed": computed,
+        "failed": len(keys) - reused - computed,
+        "duration": round(duration, 3)
+    }
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.metrics import register_collector
+from app.utils.env import LLM_CACHE_SIZE, LLM_CACHE_DIR, LLM_CACHE_TTL, LLM_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# cache counters
+CACHE_STATS = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "evictions": 0
+}
+
+# build cache key from the full request (prompt + model parameters)
+def make_key(request_args: dict) -> str:
+    payload = json.dumps(request_args, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+        Two-layer LLM response cache: in-memory LRU and optional on-disk store.
+        Values are serialized responses (str), entries expire after ttl seconds.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400,
+                 cache_dir: str = None, max_bytes: int = 100 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> str:
+        now = time.time()
+
+        # memory layer
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self.memory.move_to_end(key)
+                    CACHE_STATS["memory_hits"] += 1
+                    return value
+                del self.memory[key]
+
+        # disk layer
+        value = self.read_disk(key, now)
+        if value is not None:
+            self.set_memory(key, value)
+            CACHE_STATS["disk_hits"] += 1
+            return value
+
+        CACHE_STATS["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str):
+        self.set_memory(key, value)
+        self.write_disk(key, value)
+
+    def set_memory(self, key: str, value: str):
+        with self.lock:
+            self.memory[key] = (time.time(), value)
+            self.memory.move_to_end(key)
+
+            # evict least recently used
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+                CACHE_STATS["evictions"] += 1
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def read_disk(self, key: str, now: float) -> str:
+        if not self.cache_dir:
+            return None
+
+        path = self.path(key)
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_disk(self, key: str, value: str):
+        if not self.cache_dir:
+            return
+
+        # write to temp file first so readers never see partial entries
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Error writing LLM cache entry: %s", e)
+            return
+
+        self.evict_disk()
+
+    def evict_disk(self):
+        # drop expired entries, then oldest entries until under the size budget
+        now = time.time()
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            if now - stat.st_mtime > self.ttl:
+                self.remove_file(path)
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        while total > self.max_bytes and entries:
+            _, size, path = entries.pop(0)
+            self.remove_file(path)
+            total -= size
+
+    def remove_file(self, path: str):
+        try:
+            os.remove(path)
+            CACHE_STATS["evictions"] += 1
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+
+
+# shared cache instance
+response_cache = ResponseCache(max_entries=LLM_CACHE_SIZE,
+                               ttl=LLM_CACHE_TTL,
+                               cache_dir=LLM_CACHE_DIR,
+                               max_bytes=LLM_CACHE_MAX_BYTES)
+
+
+# expose cache counters on /metrics
+def cache_metrics() -> list:
+    return [
+        ("insightai_llm_cache_events_total", "counter", "LLM response cache lookups and evictions.",
+         [({"event": event}, value) for event, value in CACHE_STATS.items()]),
+        ("insightai_llm_cache_entries", "gauge", "Entries in the in-memory LLM response cache.",
+         [({}, len(response_cache.memory))])
+    ]
+
+register_collector(cache_metrics)
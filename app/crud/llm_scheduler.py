@@ -0,0 +1,267 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app.utils.metrics import register_collector, LLM_QUEUE_SECONDS, LLM_REJECTED
+from app.utils.env import (LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE, LLM_QUEUE_SIZE,
+                           LLM_COMPLETION_TOKENS)
+
+# weight of the latest observation in the running averages
+EWMA_WEIGHT = 0.2
+# prompt characters per token for the admission estimate
+CHARS_PER_TOKEN = 4
+
+
+class LLMBusy(Exception):
+    """
+        Raised when the LLM wait queue is full, retry_after is a wait estimate in seconds.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM queue is full, retry in {retry_after} s")
+        self.retry_after = retry_after
+
+
+class Waiter:
+    """
+        Queued LLM call, woken through a future (async callers) or an event (sync callers).
+    """
+
+    def __init__(self, session: str, kind: str, estimate: float, loop=None):
+        self.session = session
+        self.kind = kind
+        self.estimate = estimate
+        self.enqueued = time.perf_counter()
+        self.started = None
+        self.granted = False
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+
+    def wake(self):
+        self.granted = True
+        self.started = time.perf_counter()
+        LLM_QUEUE_SECONDS.observe(self.started - self.enqueued, kind=self.kind)
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(self.resolve)
+        else:
+            self.event.set()
+
+    def resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class LLMScheduler:
+    """
+        Admission control in front of the upstream model.
+        At most max_concurrency calls run at once and a token bucket refilled at
+        tokens_per_minute is charged an estimate per call, reconciled with the
+        usage the response reports. Calls beyond that wait in per-session queues
+        served round robin, so one session cannot starve the others; when
+        max_queue calls are waiting new ones are rejected with LLMBusy.
+    """
+
+    def __init__(self, max_concurrency: int = 8, tokens_per_minute: int = 0,
+                 max_queue: int = 100, completion_tokens: int = 500):
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate = tokens_per_minute / 60
+        self.capacity = float(tokens_per_minute)
+        self.max_queue = max_queue
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+        self.running = 0
+        self.depth = 0
+        # session -> deque of waiters, the first session is served next
+        self.queues = OrderedDict()
+        self.timer = None
+        self.lock = threading.Lock()
+
+        # observed completion tokens per prompt kind and seconds per call
+        self.completion = {}
+        self.default_completion = completion_tokens
+        self.latency = None
+
+    # token estimate of a call: prompt characters plus the completion size seen so far
+    def estimate(self, kind: str, args: dict) -> float:
+        chars = sum(len(message.get("content") or "") for message in args.get("messages", []))
+        return chars / CHARS_PER_TOKEN + self.completion.get(kind, self.default_completion)
+
+    # queue has room for another call
+    def admits(self) -> bool:
+        with self.lock:
+            return self.depth < self.max_queue
+
+    def retry_after(self) -> int:
+        with self.lock:
+            return self.retry_after_locked()
+
+    async def acquire_async(self, session: str, kind: str, args: dict) -> Waiter:
+        waiter = self.enqueue(Waiter(session, kind, self.estimate(kind, args), asyncio.get_running_loop()))
+        if waiter.granted:
+            return waiter
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self.abandon(waiter)
+            raise
+        return waiter
+
+    def acquire(self, session: str, kind: str, args: dict) -> Waiter:
+        waiter = self.enqueue(Waiter(session, kind, self.estimate(kind, args)))
+        waiter.event.wait()
+        return waiter
+
+    # return a slot, usage reconciles the token estimate with what was spent
+    def release(self, waiter: Waiter, usage=None):
+        with self.lock:
+            self.running -= 1
+            self.refill_locked()
+
+            if usage is not None:
+                completion = usage.completion_tokens or 0
+                spent = (usage.prompt_tokens or 0) + completion
+                if self.rate > 0:
+                    self.tokens -= spent - waiter.estimate
+                previous = self.completion.get(waiter.kind, completion)
+                self.completion[waiter.kind] = previous + EWMA_WEIGHT * (completion - previous)
+
+                elapsed = time.perf_counter() - waiter.started
+                self.latency = elapsed if self.latency is None else self.latency + EWMA_WEIGHT * (elapsed - self.latency)
+
+            self.dispatch_locked()
+
+    # upstream rate limited us, hold queued calls until the bucket refills
+    def throttle(self):
+        with self.lock:
+            if self.rate > 0:
+                self.tokens = min(self.tokens, 0)
+
+    def stats(self) -> dict:
+        with self.lock:
+            self.refill_locked()
+            return {
+                "running": self.running,
+                "queued": self.depth,
+                "sessions": len(self.queues),
+                "tokens": self.tokens if self.rate > 0 else None
+            }
+
+    def enqueue(self, waiter: Waiter) -> Waiter:
+        with self.lock:
+            self.refill_locked()
+
+            # nothing waiting ahead, run now if a slot and tokens are free
+            if self.depth == 0 and self.can_run_locked(waiter):
+                self.grant_locked(waiter)
+                return waiter
+
+            if self.depth >= self.max_queue:
+                LLM_REJECTED.inc(kind=waiter.kind)
+                raise LLMBusy(self.retry_after_locked())
+
+            self.queues.setdefault(waiter.session, deque()).append(waiter)
+            self.depth += 1
+            self.dispatch_locked()
+        return waiter
+
+    # cancelled while waiting: leave the queue, or give back a slot granted meanwhile
+    def abandon(self, waiter: Waiter):
+        with self.lock:
+            if waiter.granted:
+                self.running -= 1
+                self.tokens += waiter.estimate if self.rate > 0 else 0
+                self.dispatch_locked()
+                return
+
+            queue = self.queues.get(waiter.session)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                self.depth -= 1
+                if not queue:
+                    del self.queues[waiter.session]
+
+    def can_run_locked(self, waiter: Waiter) -> bool:
+        if self.running >= self.max_concurrency:
+            return False
+        # calls larger than the bucket run once it is full
+        return self.rate <= 0 or self.tokens >= min(waiter.estimate, self.capacity)
+
+    def grant_locked(self, waiter: Waiter):
+        self.running += 1
+        if self.rate > 0:
+            self.tokens -= waiter.estimate
+        waiter.wake()
+
+    def dispatch_locked(self):
+        while self.queues:
+            session, queue = next(iter(self.queues.items()))
+            waiter = queue[0]
+            if not self.can_run_locked(waiter):
+                # out of tokens, wake up when enough have refilled
+                if self.running < self.max_concurrency:
+                    self.schedule_locked((min(waiter.estimate, self.capacity) - self.tokens) / self.rate)
+                return
+
+            queue.popleft()
+            self.depth -= 1
+            # round robin: the session goes to the back with its remaining calls
+            del self.queues[session]
+            if queue:
+                self.queues[session] = queue
+            self.grant_locked(waiter)
+
+    def schedule_locked(self, delay: float):
+        if self.timer is not None:
+            return
+        self.timer = threading.Timer(max(delay, 0.01), self.on_timer)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def on_timer(self):
+        with self.lock:
+            self.timer = None
+            self.refill_locked()
+            self.dispatch_locked()
+
+    def refill_locked(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # seconds until a call queued now would likely start
+    def retry_after_locked(self) -> int:
+        ahead = self.depth + 1
+        seconds = math.ceil(ahead / self.max_concurrency) * (self.latency or 1)
+        if self.rate > 0:
+            average = self.default_completion if not self.completion else sum(self.completion.values()) / len(self.completion)
+            seconds = max(seconds, (ahead * average - self.tokens) / self.rate)
+        return max(1, math.ceil(seconds))
+
+
+# shared scheduler instance
+scheduler = LLMScheduler(max_concurrency=LLM_MAX_CONCURRENCY,
+                         tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                         max_queue=LLM_QUEUE_SIZE,
+                         completion_tokens=LLM_COMPLETION_TOKENS)
+
+
+# expose queue depth, running calls and bucket level on /metrics
+def scheduler_metrics() -> list:
+    stats = scheduler.stats()
+    metrics = [
+        ("insightai_llm_queue_depth", "gauge", "LLM calls waiting for a slot.", [({}, stats["queued"])]),
+        ("insightai_llm_running", "gauge", "LLM calls in flight.", [({}, stats["running"])]),
+        ("insightai_llm_queue_sessions", "gauge", "Sessions with LLM calls waiting.", [({}, stats["sessions"])])
+    ]
+    if stats["tokens"] is not None:
+        metrics.append(("insightai_llm_bucket_tokens", "gauge", "Tokens left in the LLM rate bucket.",
+                        [({}, round(stats["tokens"], 1))]))
+    return metrics
+
+register_collector(scheduler_metrics)
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import time
+from pathlib import Path
+
+import httpx
+from openai import APITimeoutError, RateLimitError, InternalServerError
+from openai.types.chat import ChatCompletion
+
+from app.crud.llm_cache import make_key
+from app.utils.env import (LLM_FIXTURES_DIR, LLM_REPLAY_LATENCY_MS, LLM_REPLAY_JITTER_MS,
+                           LLM_REPLAY_DISTRIBUTION, LLM_REPLAY_ERROR_RATE, LLM_REPLAY_ERROR_KINDS)
+
+logger = logging.getLogger(__name__)
+
+LIB_DIR = Path(__file__).resolve().parent.parent / "lib"
+
+# seed fixtures served when no recording matches the prompt hash
+SEED_FIXTURES = {
+    "intent": LIB_DIR / "TEST_INTRES.json",
+    "insight": LIB_DIR / "TEST_INSRES.json"
+}
+
+# markers identifying which prompt a request carries
+PROMPT_MARKERS = {
+    "intent": "distinct analytical topics",
+    "insight": "Summarize the key insight"
+}
+
+# detect prompt kind from the user message
+def prompt_kind(args: dict) -> str:
+    user_text = args["messages"][-1]["content"]
+    for kind, marker in PROMPT_MARKERS.items():
+        if marker in user_text:
+            return kind
+    return None
+
+# build a chat completion from plain content
+def make_completion(args: dict, content: str) -> ChatCompletion:
+    prompt_chars = sum(len(m["content"]) for m in args["messages"])
+    prompt_tokens = max(prompt_chars // 4, 1)
+    completion_tokens = max(len(content) // 4, 1)
+
+    return ChatCompletion.model_validate({
+        "id": f"replay-{make_key(args)[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": args["model"],
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content}
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    })
+
+
+class OpenAITransport:
+    """
+        Sends chat completions to the configured model endpoint.
+    """
+
+    def __init__(self, client, async_client):
+        self.client = client
+        self.async_client = async_client
+
+    def complete(self, args: dict) -> ChatCompletion:
+        return self.client.chat.completions.create(**args)
+
+    async def complete_async(self, args: dict) -> ChatCompletion:
+        return await self.async_client.chat.completions.create(**args)
+
+
+class RecordTransport(OpenAITransport):
+    """
+        Sends requests upstream and saves every response keyed by prompt hash.
+    """
+
+    def __init__(self, client, async_client, fixtures_dir: str):
+        super().__init__(client, async_client)
+        self.fixtures_dir = fixtures_dir
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+
+    def complete(self, args: dict) -> ChatCompletion:
+        response = super().complete(args)
+        self.save(args, response)
+        return response
+
+    async def complete_async(self, args: dict) -> ChatCompletion:
+        response = await super().complete_async(args)
+        self.save(args, response)
+        return response
+
+    def save(self, args: dict, response: ChatCompletion):
+        key = make_key(args)
+        path = os.path.join(self.fixtures_dir, f"{key}.json")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "key": key,
+                    "kind": prompt_kind(args),
+                    "response": response.model_dump(mode="json")
+                }, f)
+        except OSError as e:
+            logger.warning("Error recording LLM response: %s", e)
+
+
+class ReplayTransport:
+    """
+        Serves recorded responses without network access.
+        Lookup is by prompt hash, then by prompt kind (seeded from app/lib).
+        Latency and errors are injected from the configured distributions.
+    """
+
+    def __init__(self, fixtures_dir: str = None, latency_ms: float = 0, jitter_ms: float = 0,
+                 distribution: str = "fixed", error_rate: float = 0, error_kinds: list = None,
+                 seed: int = None):
+        self.fixtures_dir = fixtures_dir
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.error_kinds = error_kinds or ["timeout"]
+        self.random = random.Random(seed)
+        self.recorded = {}
+        self.by_kind = {}
+
+        for kind, path in SEED_FIXTURES.items():
+            with open(path, "r", encoding="utf-8") as f:
+                self.by_kind[kind] = f.read()
+
+        if self.fixtures_dir and os.path.isdir(self.fixtures_dir):
+            self.load(self.fixtures_dir)
+
+    def load(self, fixtures_dir: str):
+        for name in os.listdir(fixtures_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(fixtures_dir, name), "r", encoding="utf-8") as f:
+                    fixture = json.load(f)
+                response = ChatCompletion.model_validate(fixture["response"])
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Error loading LLM fixture '%s': %s", name, e)
+                continue
+
+            self.recorded[fixture["key"]] = response
+            # latest recording of a kind also serves unmatched prompts
+            if fixture.get("kind"):
+                self.by_kind[fixture["kind"]] = response.choices[0].message.content
+
+    def lookup(self, args: dict) -> ChatCompletion:
+        response = self.recorded.get(make_key(args))
+        if response is not None:
+            return response
+
+        content = self.by_kind.get(prompt_kind(args), "[]")
+        return make_completion(args, content)
+
+    def delay(self) -> float:
+        mean = self.latency_ms / 1000
+        jitter = self.jitter_ms / 1000
+
+        if self.distribution == "normal":
+            return max(self.random.gauss(mean, jitter), 0)
+        if self.distribution == "uniform":
+            return max(self.random.uniform(mean - jitter, mean + jitter), 0)
+        if self.distribution == "lognormal" and mean > 0:
+            # parameters chosen so the distribution has the given mean and std
+            variance = jitter ** 2
+            sigma2 = math.log(1 + variance / mean ** 2)
+            mu = math.log(mean) - sigma2 / 2
+            return self.random.lognormvariate(mu, sigma2 ** 0.5)
+        return mean
+
+    def maybe_fail(self, args: dict):
+        if self.error_rate <= 0 or self.random.random() >= self.error_rate:
+            return
+
+        kind = self.random.choice(self.error_kinds)
+        request = httpx.Request("POST", "http://replay.invalid/chat/completions")
+
+        if kind == "rate_limit":
+            raise RateLimitError("Replay: rate limited",
+                                 response=httpx.Response(429, request=request), body=None)
+        if kind == "server":
+            raise InternalServerError("Replay: server error",
+                                      response=httpx.Response(500, request=request), body=None)
+        raise APITimeoutError(request=request)
+
+    def complete(self, args: dict) -> ChatCompletion:
+        time.sleep(self.delay())
+        self.maybe_fail(args)
+        return self.lookup(args)
+
+    async def complete_async(self, args: dict) -> ChatCompletion:
+        await asyncio.sleep(self.delay())
+        self.maybe_fail(args)
+        return self.lookup(args)
+
+
+# build transport for the configured mode
+def make_transport(mode: str, client, async_client):
+    if mode == "record":
+        return RecordTransport(client, async_client, LLM_FIXTURES_DIR)
+
+    if mode == "replay":
+        return ReplayTransport(fixtures_dir=LLM_FIXTURES_DIR,
+                               latency_ms=LLM_REPLAY_LATENCY_MS,
+                               jitter_ms=LLM_REPLAY_JITTER_MS,
+                               distribution=LLM_REPLAY_DISTRIBUTION,
+                               error_rate=LLM_REPLAY_ERROR_RATE,
+                               error_kinds=LLM_REPLAY_ERROR_KINDS)
+
+    return OpenAITransport(client, async_client)
@@ -1,21 +1,65 @@
 import json, re
+import threading
+import httpx
 import pandas as pd
-from openai import OpenAI
-
-from app.utils.env import BASE_URL, API_KEY
-
-# initialize OpenAI client
-client = OpenAI(base_url=BASE_URL, 
-                api_key=API_KEY)
-
-# generate prompt and get response from OpenAI
-def generate_prompt(system_text: str, user_text: str) -> str:
-    response = client.chat.completions.create(
-        model="openai/gpt-4o",
-        temperature=0,
-        max_tokens=4096,
-        top_p=1,
-        messages=[
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, Timeout, RateLimitError
+from openai.types.chat import ChatCompletion
+
+from app.crud.llm_cache import response_cache, make_key
+from app.crud.llm_transport import make_transport, prompt_kind
+from app.crud.llm_scheduler import scheduler
+from app.utils.metrics import LLM_TOKENS, LLM_REQUESTS
+from app.crud.planner import compile_plan, execute_plan, explain_plan
+from app.crud.profiler import approx_distinct
+from app.crud.prompt_budget import compact_results, dump_results
+
+from app.utils.env import (BASE_URL, API_KEY, LLM_TIMEOUT, LLM_CONNECT_TIMEOUT,
+                           LLM_MAX_RETRIES, LLM_MAX_CONNECTIONS, LLM_TRANSPORT, INSIGHT_TOKEN_BUDGET)
+
+LLM_MODEL = "openai/gpt-4o"
+
+# OpenAI clients and the transport are created on first use, not at import
+clients = {}
+clients_lock = threading.Lock()
+
+# transport behind generate_prompt (upstream, record or replay)
+def get_transport():
+    if "transport" in clients:
+        return clients["transport"]
+
+    with clients_lock:
+        if "transport" not in clients:
+            client = OpenAI(base_url=BASE_URL, 
+                            api_key=API_KEY,
+                            timeout=Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                            max_retries=LLM_MAX_RETRIES)
+
+            # shared async client with a pooled HTTP connection
+            async_client = AsyncOpenAI(
+                base_url=BASE_URL,
+                api_key=API_KEY,
+                timeout=Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                max_retries=LLM_MAX_RETRIES,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                        max_keepalive_connections=LLM_MAX_CONNECTIONS)
+                )
+            )
+
+            clients["client"] = client
+            clients["async_client"] = async_client
+            clients["transport"] = make_transport(LLM_TRANSPORT, client, async_client)
+
+    return clients["transport"]
+
+# request parameters shared by the sync and async calls
+def completion_args(system_text: str, user_text: str) -> dict:
+    return {
+        "model": LLM_MODEL,
+        "temperature": 0,
+        "max_tokens": 4096,
+        "top_p": 1,
+        "messages": [
             {
                 "role":"system",
                 "content": system_text
@@ -25,10 +69,91 @@ def generate_prompt(system_text: str, user_text: str) -> str:
                 "content": user_text
             }
         ]
-    )
+    }
+
+# look up a cached response for identical request parameters
+def cached_response(key: str) -> ChatCompletion:
+    cached = response_cache.get(key)
+    if cached is None:
+        return None
+
+    try:
+        return ChatCompletion.model_validate_json(cached)
+    except ValueError:
+        return None
+
+# store response (temperature=0 makes responses reusable)
+def cache_response(key: str, response: ChatCompletion):
+    if not response.choices or not response.choices[0].message.content:
+        return
+    response_cache.set(key, response.model_dump_json())
+
+# count calls and upstream token usage
+def record_usage(args: dict, response: ChatCompletion, source: str):
+    kind = prompt_kind(args) or "other"
+    LLM_REQUESTS.inc(kind=kind, source=source)
+
+    # cached responses did not spend tokens
+    usage = getattr(response, "usage", None)
+    if source != "cache" and usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens or 0, kind=kind, direction="in")
+        LLM_TOKENS.inc(usage.completion_tokens or 0, kind=kind, direction="out")
+
+# generate prompt and get response from OpenAI
+# (upstream calls wait for the scheduler, LLMBusy is raised when its queue is full)
+def generate_prompt(system_text: str, user_text: str, session: str = None) -> str:
+    args = completion_args(system_text, user_text)
+    key = make_key(args)
+
+    response = cached_response(key)
+    if response is not None:
+        record_usage(args, response, "cache")
+        return response
+
+    kind = prompt_kind(args) or "other"
+    slot = scheduler.acquire(session, kind, args)
+    try:
+        response = get_transport().complete(args)
+    except RateLimitError:
+        scheduler.throttle()
+        raise
+    finally:
+        scheduler.release(slot, getattr(response, "usage", None))
+    record_usage(args, response, "upstream")
+    cache_response(key, response)
 
     return response
 
+# async variant, does not hold a threadpool thread while waiting
+async def generate_prompt_async(system_text: str, user_text: str, session: str = None) -> str:
+    args = completion_args(system_text, user_text)
+    key = make_key(args)
+
+    response = cached_response(key)
+    if response is not None:
+        record_usage(args, response, "cache")
+        return response
+
+    kind = prompt_kind(args) or "other"
+    slot = await scheduler.acquire_async(session, kind, args)
+    try:
+        response = await get_transport().complete_async(args)
+    except RateLimitError:
+        scheduler.throttle()
+        raise
+    finally:
+        scheduler.release(slot, getattr(response, "usage", None))
+    record_usage(args, response, "upstream")
+    cache_response(key, response)
+
+    return response
+
+# close pooled connections on shutdown
+async def close_clients():
+    if "client" in clients:
+        clients["client"].close()
+        await clients["async_client"].close()
+
 # system prompt
 def system_prompt() -> str:
     return """
@@ -37,15 +162,24 @@ def system_prompt() -> str:
         If unclear, return {}.
         """
 
-# intent prompt
-def intent_prompt(df: pd.DataFrame) -> str:
+# intent prompt, distinct counts come from the session profile when given
+def intent_prompt(df: pd.DataFrame, rows: int = None, profile: dict = None) -> str:
     column = df.columns.tolist()
     datatype = df.dtypes.to_list()
 
-    column_info = list(zip(column, datatype, df.nunique()))
+    if profile is None:
+        distinct = df.nunique().to_list()
+    else:
+        # columns added by cleaning (e.g. date parts) are not in the profile
+        distinct = [profile[c]["distinct"] if c in profile else approx_distinct(df[c]) for c in column]
+
+    column_info = list(zip(column, datatype, distinct))
     column_text = "\n".join([f"- {col} ({dtype}, unique={n})" for col, dtype, n in column_info])
 
     row, col = df.shape
+    # large files are profiled from a sample, report the full row count
+    if rows is not None:
+        row = rows
 
     prompt=f"""
         Given a dataset schema, generate up to 5 distinct analytical topics.
@@ -93,10 +227,13 @@ def intent_prompt(df: pd.DataFrame) -> str:
     
     return prompt
 
-# insight prompt
-def insight_prompt(response_json: list) -> str:
+# insight prompt, results are compacted to the token budget (truncation written to report if given)
+def insight_prompt(response_json: list, report: dict = None, budget: int = INSIGHT_TOKEN_BUDGET) -> str:
+    if isinstance(response_json, str):
+        response_json = try_parse_json(response_json)
+
     # convert response to json string
-    response_json_str = json.dumps(response_json)
+    response_json_str = dump_results(compact_results(response_json, budget=budget, report=report))
 
     prompt=f"""
         Summarize the key insight for each topic in 2–3 sentences using ONLY the given results.
@@ -149,119 +286,19 @@ def combine_results(intents, insights) -> list:
         
     return combined_results
 
-# analyze intent from OpenAI response
-def analyze_intent(df_original: pd.DataFrame, response : str) -> str:
-    result_list = []
+# analyze intent from OpenAI response, the plan summary is written to explain if given
+# (on_result is called with each topic's index and result as soon as it completes)
+def analyze_intent(df_original: pd.DataFrame, response : str, explain : dict = None, on_result = None) -> str:
     data = try_parse_json(response)
 
-    for item in data:
-        try:
-            # 1. fresh copy of the dataframe
-            df = df_original.copy()
-            
-            topic = item.get("topic")
-            agg = item.get("aggregation")
-            group_by = item.get("group_by")
-            measures = item.get("measure")
-            relationship = item.get("relationship")
-            filters = item.get("filters")
-            sort_by = item.get("sort_by")
-            ascending = item.get("ascending", True)
-            limit = item.get("limit")
-
-            # Normalize measures and group_by to lists
-            if isinstance(measures, str):
-                measures = [measures]
-            #if group_by and isinstance(group_by, str):
-                #group_by = [group_by]
-
-            # 2. Apply filters
-            if filters:
-                # FIX: If filters is a single dict, turn it into a list so the loop works
-                if isinstance(filters, dict):
-                    # If it's the specific MongoDB style {'col': {'$ne': val}}, 
-                    # you might need to flatten it, but for your loop to not CRASH:
-                    filter_list = [filters]
-                else:
-                    filter_list = filters
-
-                for f in filter_list:
-                    # Double check f is a dict before calling .get()
-                    if not isinstance(f, dict):
-                        continue
-                        
-                    col, op, val = f.get("column"), f.get("operator"), f.get("value")
-                    
-                    if isinstance(col, list): col = col[0]
-                    
-                    if col and col in df.columns:
-                        if op == "=":   df = df[df[col] == val]
-                        elif op == ">":  df = df[df[col] > val]
-                        elif op == "<":  df = df[df[col] < val]
-                        elif op == ">=": df = df[df[col] >= val]
-                        elif op == "<=": df = df[df[col] <= val]
-                        elif op == "!=": df = df[df[col] != val]
-
-            # 3. Relationship analysis
-            if relationship == "correlation" and measures:
-                rel_result = df[measures].corr()
-                result_list.append({
-                    "topic": topic,
-                    "relationship": relationship,
-                    "result": rel_result.to_dict()
-                })
-
-            # 4. Aggregation analysis
-            elif agg:
-                if group_by:
-                    agg_result = df.groupby(group_by)[measures].agg(agg)
-                    #agg_result = agg_result.reset_index()
-                else:
-                    agg_result = df[measures].agg(agg)
-
-                # Ensure it is a DataFrame
-                if isinstance(agg_result, pd.Series):
-                    agg_result = agg_result.to_frame(name='value')
-                    if agg_result.index.name is None:
-                        agg_result.index.name = 'category'
-                    # Reset this index too so 'category' becomes a column
-                    #agg_result = agg_result.reset_index()
-
-                # --- sorting ---
-                if sort_by:
-                    # If sort_by is a list ['total'], take the first string 'total'
-                    if isinstance(sort_by, list) and len(sort_by) > 0:
-                        sort_target = sort_by[0]
-                    else:
-                        sort_target = sort_by
-                    
-                    try:
-                        # Try sorting by the requested column
-                        agg_result = agg_result.sort_values(by=sort_target, ascending=ascending)
-                    except:
-                        # Fallback: Sort by the first numeric column available
-                        if len(agg_result.columns) > 0:
-                            agg_result = agg_result.sort_values(by=agg_result.columns[-1], ascending=ascending)
-
-                if limit:
-                    try:
-                        agg_result = agg_result.head(int(limit))
-                    except:
-                        pass
-                
-                # Ensure index is string to avoid JSON serialization errors
-                agg_result.index = agg_result.index.astype(str)
-                final_data = agg_result.reset_index().to_dict(orient='records')
-                
-                result_list.append({
-                    "topic": topic,
-                    "aggregation": agg,
-                    "result": final_data
-                })
-
-        except Exception as e:
-            print(f"Error processing topic '{item.get('topic')}': {e}")
-            continue
+    # compile intents into a plan sharing filters and group-bys
+    plan = compile_plan(df_original, data)
+    if explain is not None:
+        explain.update(explain_plan(plan))
+
+    result_list = execute_plan(df_original, plan, on_result)
+    if explain is not None:
+        explain["topic_seconds"] = list(plan["topic_seconds"].values())
 
     if len(result_list) == 0:
         return None
@@ -270,9 +307,7 @@ def analyze_intent(df_original: pd.DataFrame, response : str) -> str:
 
 # analyze insight from OpenAI response
 def analyze_insight(response: str) -> dict:
-    data = try_parse_json(response)
-    print(data)
-    return data
+    return try_parse_json(response)
 
 # try parse json
 def try_parse_json(response: str) -> dict:
@@ -0,0 +1,454 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import pandas as pd
+
+from app.utils.env import TOPIC_WORKERS, TOPIC_TIMEOUT
+from app.utils.metrics import TOPIC_SECONDS, FAILED_TOPICS
+
+logger = logging.getLogger(__name__)
+
+# shared by all jobs so concurrent reports cannot oversubscribe the cpu
+topic_pool = ThreadPoolExecutor(max_workers=TOPIC_WORKERS, thread_name_prefix="topic") if TOPIC_WORKERS > 0 else None
+
+# how often a waiting job checks whether a queued task has started
+TASK_POLL_SECONDS = 0.05
+# a task still queued after this many timeouts is dropped (workers stuck on abandoned tasks)
+TASK_QUEUE_TIMEOUT_FACTOR = 2
+
+# aggregations that can be fused into a single .agg call
+SUPPORTED_AGGS = ["mean", "sum", "count", "min", "max", "median"]
+
+# filter operators applied as boolean masks
+FILTER_OPS = {
+    "=":  lambda s, v: s == v,
+    ">":  lambda s, v: s > v,
+    "<":  lambda s, v: s < v,
+    ">=": lambda s, v: s >= v,
+    "<=": lambda s, v: s <= v,
+    "!=": lambda s, v: s != v,
+}
+
+# normalize filters to a list of (column, operator, value) for existing columns
+def normalize_filters(filters, columns) -> list:
+    if not filters:
+        return []
+
+    # If filters is a single dict, turn it into a list so the loop works
+    filter_list = [filters] if isinstance(filters, dict) else filters
+
+    normalized = []
+    for f in filter_list:
+        # Double check f is a dict before calling .get()
+        if not isinstance(f, dict):
+            continue
+
+        col, op, val = f.get("column"), f.get("operator"), f.get("value")
+
+        if isinstance(col, list): col = col[0]
+
+        if col and col in columns and op in FILTER_OPS:
+            normalized.append((col, op, val))
+
+    return normalized
+
+# hashable key for a value that may be a list
+def as_key(value):
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+# compile parsed intents into an execution plan
+def compile_plan(df: pd.DataFrame, intents: list) -> dict:
+    rows, cols = df.shape
+    plan = {
+        "rows": rows,
+        "filters": {},
+        "groups": {},
+        "topics": []
+    }
+
+    for index, item in enumerate(intents):
+        if not isinstance(item, dict):
+            continue
+
+        measures = item.get("measure")
+        group_by = item.get("group_by")
+        agg = item.get("aggregation")
+
+        # Normalize measures to a list
+        if isinstance(measures, str):
+            measures = [measures]
+
+        # filters sharing the same conditions share one mask
+        filters = normalize_filters(item.get("filters"), df.columns)
+        filter_key = json.dumps(filters, default=str) if filters else None
+        if filter_key is not None:
+            plan["filters"][filter_key] = filters
+
+        topic = {
+            "index": index,
+            "item": item,
+            "measures": measures,
+            "filter_key": filter_key,
+            "group_key": None
+        }
+
+        if item.get("relationship") == "correlation" and measures:
+            topic["kind"] = "correlation"
+
+        elif agg and group_by:
+            topic["kind"] = "group_agg"
+
+            group_key = json.dumps([filter_key, as_key(group_by)], default=str)
+            topic["group_key"] = group_key
+
+            group = plan["groups"].setdefault(group_key, {
+                "filter_key": filter_key,
+                "group_by": group_by,
+                "aggs": {},
+                "columns": [],
+                "topics": [],
+                "fusable": True
+            })
+            group["topics"].append(index)
+
+            # columns to materialize when the group is filtered (None means all)
+            group_cols = group_by if isinstance(group_by, list) else [group_by]
+            if group["columns"] is not None and isinstance(measures, list) and all(
+                    isinstance(c, str) and c in df.columns for c in group_cols + measures):
+                for c in group_cols + measures:
+                    if c not in group["columns"]:
+                        group["columns"].append(c)
+            else:
+                group["columns"] = None
+
+            # only plain aggregations over known columns can be fused
+            fusable = (
+                isinstance(agg, str) and agg in SUPPORTED_AGGS
+                and isinstance(measures, list) and len(measures) > 0
+                and len(set(measures)) == len(measures)
+                and all(isinstance(m, str) and m in df.columns for m in measures)
+            )
+            if fusable:
+                for m in measures:
+                    aggs = group["aggs"].setdefault(m, [])
+                    if agg not in aggs:
+                        aggs.append(agg)
+            else:
+                group["fusable"] = False
+
+        elif agg:
+            topic["kind"] = "agg"
+
+        else:
+            topic["kind"] = "skip"
+
+        plan["topics"].append(topic)
+
+    plan["estimated_cost"] = estimate_cost(plan)
+    return plan
+
+# rough cost in cells touched, rows are an upper bound before filtering
+def estimate_cost(plan: dict) -> dict:
+    rows = plan["rows"]
+    cost = {"filters": 0, "groupings": 0, "aggregations": 0, "correlations": 0}
+
+    for filters in plan["filters"].values():
+        cost["filters"] += rows * len(filters)
+
+    for group in plan["groups"].values():
+        cost["groupings"] += rows
+        cost["aggregations"] += rows * sum(len(aggs) for aggs in group["aggs"].values())
+
+    for topic in plan["topics"]:
+        measures = topic["measures"] or []
+        if topic["kind"] == "correlation":
+            cost["correlations"] += rows * len(measures) ** 2
+        elif topic["kind"] == "agg":
+            cost["aggregations"] += rows * len(measures)
+
+    cost["total"] = sum(cost.values())
+    return cost
+
+# inspectable summary of a plan
+def explain_plan(plan: dict) -> dict:
+    return {
+        "rows": plan["rows"],
+        "filters": list(plan["filters"].values()),
+        "groups": [
+            {
+                "group_by": group["group_by"],
+                "filters": plan["filters"].get(group["filter_key"], []),
+                "aggs": group["aggs"],
+                "topics": group["topics"],
+                "fused": group["fusable"] and len(group["topics"]) > 1
+            }
+            for group in plan["groups"].values()
+        ],
+        "topics": [
+            {
+                "index": topic["index"],
+                "topic": topic["item"].get("topic"),
+                "kind": topic["kind"]
+            }
+            for topic in plan["topics"]
+        ],
+        "estimated_cost": plan["estimated_cost"]
+    }
+
+# compacted (unordered) categories group like plain strings, only observed values;
+# ordered categories such as months keep every category
+def observed_groups(df: pd.DataFrame, group_by) -> bool:
+    cols = group_by if isinstance(group_by, list) else [group_by]
+    for col in cols:
+        dtype = df[col].dtype if col in df.columns else None
+        if isinstance(dtype, pd.CategoricalDtype) and dtype.ordered:
+            return False
+    return True
+
+# compacted (unordered) categories aggregate like plain strings, min/max refuse them otherwise
+def plain_measures(df: pd.DataFrame, measures) -> pd.DataFrame:
+    cols = [c for c in (measures if isinstance(measures, list) else [])
+            if isinstance(c, str) and c in df.columns
+            and isinstance(df[c].dtype, pd.CategoricalDtype) and not df[c].dtype.ordered]
+    cols = list(dict.fromkeys(cols))
+    if not cols:
+        return df
+    return df.assign(**{c: df[c].astype(object) for c in cols})
+
+# build boolean mask for a filter key
+def build_mask(df: pd.DataFrame, filters: list) -> pd.Series:
+    mask = pd.Series(True, index=df.index)
+    for col, op, val in filters:
+        series = df[col]
+
+        # compare compacted categories as plain values
+        if isinstance(series.dtype, pd.CategoricalDtype) and not series.dtype.ordered and op not in ("=", "!="):
+            series = series.astype(object)
+
+        mask &= FILTER_OPS[op](series, val)
+    return mask
+
+# execute plan, returns results in intent order (on_result also gets each topic as it finishes)
+def execute_plan(df: pd.DataFrame, plan: dict, on_result=None) -> list:
+    masks = {}
+    groupbys = {}
+    fused = {}
+    locks = {}
+    locks_guard = threading.Lock()
+
+    # build a shared mask or group-by once, even when topics run in parallel
+    def cached(cache, key, build):
+        with locks_guard:
+            lock = locks.setdefault((id(cache), key), threading.Lock())
+        with lock:
+            if key not in cache:
+                cache[key] = build()
+        return cache[key]
+
+    def filtered(filter_key, columns=None):
+        if filter_key is None:
+            return df
+
+        mask = cached(masks, filter_key, lambda: build_mask(df, plan["filters"][filter_key]))
+        # only the needed columns of matching rows are materialized
+        return df.loc[mask, columns if columns is not None else df.columns]
+
+    def grouped(group_key):
+        def build():
+            group = plan["groups"][group_key]
+            view = filtered(group["filter_key"], group["columns"])
+            group_cols = group["group_by"] if isinstance(group["group_by"], list) else [group["group_by"]]
+            measures = [m for index in group["topics"] if isinstance(topics[index]["measures"], list)
+                        for m in topics[index]["measures"] if m not in group_cols]
+            view = plain_measures(view, measures)
+            gb = view.groupby(group["group_by"], observed=observed_groups(view, group["group_by"]))
+            # compute the group codes now instead of racing on them later
+            gb.ngroups
+            return gb
+        return cached(groupbys, group_key, build)
+
+    topics = {topic["index"]: topic for topic in plan["topics"]}
+    results = {}
+    seconds = {}
+    abandoned = set()
+    abandon_lock = threading.Lock()
+
+    def run_topic(topic):
+        item = topic["item"]
+        start = time.perf_counter()
+        try:
+            results[topic["index"]] = execute_topic(topic, filtered, grouped, fused)
+        except Exception as e:
+            logger.warning("Error processing topic '%s': %s", item.get('topic'), e)
+            FAILED_TOPICS.inc(kind=topic["kind"])
+        finally:
+            elapsed = time.perf_counter() - start
+            seconds[topic["index"]] = round(elapsed, 6)
+            TOPIC_SECONDS.observe(elapsed, kind=topic["kind"])
+
+        # hand finished topics over as they complete (called from pool threads),
+        # a topic abandoned by the timeout is not part of the job any more
+        if on_result is not None and results.get(topic["index"]) is not None:
+            with abandon_lock:
+                if topic["index"] in abandoned:
+                    return
+                try:
+                    on_result(topic["index"], results[topic["index"]])
+                except Exception:
+                    logger.exception("Error publishing topic '%s'", item.get('topic'))
+
+    # marks a topic abandoned at the moment it times out, before it can be handed over
+    def abandon(topic):
+        with abandon_lock:
+            abandoned.add(topic["index"])
+
+    # fuse aggregations over the same keys into one .agg call
+    def fuse(group_key):
+        group = plan["groups"][group_key]
+        try:
+            gb = grouped(group_key)
+            fused[group_key] = gb[list(group["aggs"].keys())].agg(group["aggs"])
+        except Exception as e:
+            # fall back to per-topic execution so only failing topics are skipped
+            logger.warning("Error fusing group '%s': %s", group['group_by'], e)
+
+    fusable = [group_key for group_key, group in plan["groups"].items()
+               if group["fusable"] and len(group["topics"]) >= 2]
+
+    if topic_pool is None:
+        for group_key in fusable:
+            fuse(group_key)
+        for topic in plan["topics"]:
+            run_topic(topic)
+    else:
+        # a fusion that times out leaves its topics to run on their own
+        for group_key in run_tasks(fuse, fusable):
+            logger.warning("Error fusing group '%s': timed out after %ss", plan['groups'][group_key]['group_by'], TOPIC_TIMEOUT)
+
+        for topic in run_tasks(run_topic, plan["topics"], on_abandon=abandon):
+            logger.warning("Error processing topic '%s': timed out after %ss", topic['item'].get('topic'), TOPIC_TIMEOUT)
+            FAILED_TOPICS.inc(kind=topic["kind"])
+
+    # snapshot in intent order, abandoned topics may still write after this
+    plan["topic_seconds"] = {index: (TOPIC_TIMEOUT if index in abandoned else seconds[index])
+                             for index in topics if index in seconds or index in abandoned}
+
+    # skipped, failed and timed out topics have no result
+    return [results[index] for index in topics
+            if index not in abandoned and results.get(index) is not None]
+
+# run func over args on the topic pool, returns the args abandoned after TOPIC_TIMEOUT
+# (on_abandon is called with each one as soon as it is given up)
+def run_tasks(func, args: list, on_abandon=None) -> list:
+    started = {}
+
+    def timed(key, arg):
+        started[key] = time.perf_counter()
+        func(arg)
+
+    submitted = time.perf_counter()
+    futures = [topic_pool.submit(timed, key, arg) for key, arg in enumerate(args)]
+
+    abandoned = []
+    for key, future in enumerate(futures):
+        while True:
+            # time spent queued behind other jobs does not count, unless the pool is stuck
+            begun = started.get(key)
+            wait = TASK_POLL_SECONDS if begun is None else TOPIC_TIMEOUT - (time.perf_counter() - begun)
+            try:
+                future.result(timeout=max(wait, 0))
+                break
+            except FutureTimeoutError:
+                if begun is None and time.perf_counter() - submitted < TASK_QUEUE_TIMEOUT_FACTOR * TOPIC_TIMEOUT:
+                    continue
+
+                # pandas cannot be interrupted, the thread finishes in the background
+                future.cancel()
+                if on_abandon is not None:
+                    on_abandon(args[key])
+                abandoned.append(args[key])
+                break
+
+    return abandoned
+
+# execute one topic using shared masks, group-bys and fused results
+def execute_topic(topic: dict, filtered, grouped, fused) -> dict:
+    item = topic["item"]
+    topic_name = item.get("topic")
+    agg = item.get("aggregation")
+    measures = topic["measures"]
+    relationship = item.get("relationship")
+
+    # Relationship analysis
+    if topic["kind"] == "correlation":
+        rel_result = filtered(topic["filter_key"])[measures].corr()
+        return {
+            "topic": topic_name,
+            "relationship": relationship,
+            "result": rel_result.to_dict()
+        }
+
+    # Aggregation analysis
+    if topic["kind"] == "group_agg":
+        group_key = topic["group_key"]
+        if group_key in fused:
+            agg_result = fused[group_key].xs(agg, axis=1, level=1)[measures]
+        else:
+            agg_result = grouped(group_key)[measures].agg(agg)
+
+    elif topic["kind"] == "agg":
+        agg_result = plain_measures(filtered(topic["filter_key"])[measures], measures).agg(agg)
+
+    else:
+        return None
+
+    return finalize_result(item, agg_result)
+
+# sort, limit and serialize an aggregation result
+def finalize_result(item: dict, agg_result) -> dict:
+    agg = item.get("aggregation")
+    sort_by = item.get("sort_by")
+    ascending = item.get("ascending", True)
+    limit = item.get("limit")
+
+    # Ensure it is a DataFrame
+    if isinstance(agg_result, pd.Series):
+        agg_result = agg_result.to_frame(name='value')
+        if agg_result.index.name is None:
+            agg_result.index.name = 'category'
+
+    # --- sorting ---
+    if sort_by:
+        # If sort_by is a list ['total'], take the first string 'total'
+        if isinstance(sort_by, list) and len(sort_by) > 0:
+            sort_target = sort_by[0]
+        else:
+            sort_target = sort_by
+
+        try:
+            # Try sorting by the requested column
+            agg_result = agg_result.sort_values(by=sort_target, ascending=ascending, kind="stable")
+        except:
+            # Fallback: Sort by the first numeric column available
+            if len(agg_result.columns) > 0:
+                agg_result = agg_result.sort_values(by=agg_result.columns[-1], ascending=ascending, kind="stable")
+
+    if limit:
+        try:
+            agg_result = agg_result.head(int(limit))
+        except:
+            pass
+
+    # Ensure index is string to avoid JSON serialization errors
+    agg_result.index = agg_result.index.astype(str)
+    final_data = agg_result.reset_index().to_dict(orient='records')
+
+    return {
+        "topic": item.get("topic"),
+        "aggregation": agg,
+        "result": final_data
+    }
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from app.crud.file_handler import infer_column_type, sample_column
+
+# HyperLogLog registers = 2 ** HLL_PRECISION (about 1.6% standard error)
+HLL_PRECISION = 12
+
+# columns with at most this many distinct values are counted exactly
+EXACT_DISTINCT_MAX = 64
+TOP_K = 5
+
+# approximate distinct count of a column, nulls excluded
+def approx_distinct(series : pd.Series) -> int:
+    return hll_estimate(series.dropna())
+
+# HyperLogLog estimate over 64-bit hashes of non-null values
+def hll_estimate(values : pd.Series, precision : int = HLL_PRECISION) -> int:
+    if len(values) == 0:
+        return 0
+
+    # hash every value directly, categorize would build the hash table HLL avoids
+    hashes = pd.util.hash_pandas_object(values, index=False, categorize=False).to_numpy(dtype=np.uint64)
+    m = 1 << precision
+
+    # first bits pick the register, the rank is the position of the first set bit after them
+    index = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+    rest = ((hashes << np.uint64(precision)) >> np.uint64(32)).astype(np.uint32)
+    rank = np.full(len(rest), 33, dtype=np.uint8)
+    nonzero = rest > 0
+    rank[nonzero] = 32 - np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.uint8)
+
+    registers = np.zeros(m, dtype=np.uint8)
+    np.maximum.at(registers, index, rank)
+
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+
+    # small cardinalities: linear counting on empty registers
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros > 0:
+        estimate = m * np.log(m / zeros)
+
+    return int(min(round(estimate), len(values)))
+
+# json friendly scalar for the session store
+def to_scalar(value):
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return None
+    if isinstance(value, (np.integer, int)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return float(value)
+    return str(value)
+
+# stats of one column, computed together so the column is scanned once
+def profile_column(series : pd.Series) -> dict:
+    rows = len(series)
+    missing = series.isna()
+    nulls = int(missing.sum())
+    distinct = hll_estimate(series[~missing] if nulls else series)
+
+    # low cardinality: exact counts are cheap and give every distinct value
+    exact = distinct <= EXACT_DISTINCT_MAX
+    counts = series.value_counts() if exact else sample_column(series).value_counts()
+    if exact:
+        distinct = len(counts)
+
+    profile = {
+        "dtype": str(series.dtype),
+        "null_ratio": round(nulls / rows, 6) if rows else 0.0,
+        "distinct": distinct,
+        "distinct_exact": exact,
+        "min": None,
+        "max": None,
+        "top": [[to_scalar(value), round(int(count) / max(int(counts.sum()), 1), 6)]
+                for value, count in counts.head(TOP_K).items()]
+    }
+
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        profile["min"] = to_scalar(series.min())
+        profile["max"] = to_scalar(series.max())
+
+    # cleaning decision for text columns, month check reuses the distinct values
+    if pd.api.types.is_object_dtype(series):
+        # (the sampled values when there are too many to count exactly)
+        profile["type"], profile["format"] = infer_column_type(series, list(counts.index), nulls > 0)
+
+    return profile
+
+# profile every column, keyed by the names micro_clean gives them
+def profile_df(df : pd.DataFrame) -> dict:
+    names = df.columns.astype(str).str.strip().str.replace(" ","_").str.lower()
+
+    profile = {}
+    for name, col in zip(names, range(df.shape[1])):
+        profile[name] = profile_column(df.iloc[:, col])
+    return profile
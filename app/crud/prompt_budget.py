@@ -0,0 +1,139 @@
+import json
+import math
+
+from app.utils.env import INSIGHT_TOKEN_BUDGET, INSIGHT_TOP_K, INSIGHT_MAX_CORRELATIONS, INSIGHT_DECIMALS
+
+# rough size of a token in JSON text, avoids a tokenizer dependency
+CHARS_PER_TOKEN = 4
+
+# estimated token count of a prompt fragment
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+# compact JSON text of the results as sent to the model
+def dump_results(results: list) -> str:
+    return json.dumps(results, separators=(",", ":"), default=str)
+
+# round every float in a nested result
+def round_values(value, decimals: int = INSIGHT_DECIMALS):
+    if isinstance(value, float):
+        return round(value, decimals) if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: round_values(v, decimals) for k, v in value.items()}
+    if isinstance(value, list):
+        return [round_values(v, decimals) for v in value]
+    return value
+
+# is a cell a usable number
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+# columns holding numbers (or nulls) in every row of a table result
+def numeric_columns(rows: list) -> list:
+    return [c for c in rows[0]
+            if all(row.get(c) is None or is_number(row.get(c)) for row in rows)
+            and any(is_number(row.get(c)) for row in rows)]
+
+# summary stats of the numeric columns of a table result
+def table_summary(rows: list, columns: list) -> dict:
+    summary = {}
+    for c in columns:
+        values = [row[c] for row in rows if is_number(row.get(c))]
+        if not values:
+            continue
+        summary[c] = {
+            "min": min(values),
+            "max": max(values),
+            "mean": sum(values) / len(values),
+            "sum": sum(values)
+        }
+    return round_values(summary)
+
+# keep the top and bottom k rows of a long table, in their original order
+def compact_table(rows: list, k: int) -> tuple:
+    if len(rows) <= 2 * k:
+        return rows, None
+
+    columns = numeric_columns(rows)
+    if columns:
+        # rank by the last measure, the one finalize_result falls back to
+        order = sorted((i for i in range(len(rows)) if is_number(rows[i].get(columns[-1]))),
+                       key=lambda i: rows[i][columns[-1]])
+        keep = sorted(set(order[:k]) | set(order[len(order) - k:])) if k > 0 else []
+    else:
+        keep = list(range(k))
+
+    return [rows[i] for i in keep], {
+        "rows": len(rows),
+        "kept": len(keep),
+        "summary": table_summary(rows, columns)
+    }
+
+# keep the strongest off-diagonal pairs of a correlation matrix
+def compact_correlation(matrix: dict, max_pairs: int) -> tuple:
+    columns = list(matrix.keys())
+    pairs = []
+    for i, a in enumerate(columns):
+        for b in columns[i + 1:]:
+            value = matrix.get(a, {}).get(b)
+            if is_number(value):
+                pairs.append({"a": a, "b": b, "r": value})
+
+    if len(pairs) <= max_pairs:
+        return matrix, None
+
+    pairs.sort(key=lambda pair: abs(pair["r"]), reverse=True)
+    return pairs[:max_pairs], {"pairs": len(pairs), "kept": max_pairs}
+
+# compact one topic result at a given level of detail
+def compact_topic(item: dict, k: int, max_pairs: int) -> tuple:
+    result = item.get("result")
+    compacted = dict(item)
+
+    if item.get("relationship") and isinstance(result, dict):
+        compacted["result"], note = compact_correlation(result, max_pairs)
+    elif isinstance(result, list) and result and all(isinstance(row, dict) for row in result):
+        compacted["result"], note = compact_table(result, k)
+        if note is not None:
+            if note["summary"]:
+                compacted["summary"] = note["summary"]
+            note = {"rows": note["rows"], "kept": note["kept"]}
+    else:
+        note = None
+
+    if note is not None:
+        # tell the model the result is partial
+        compacted["truncated"] = note
+    return compacted, note
+
+# shrink results until the insight prompt fits the token budget, truncation is written to report if given
+def compact_results(results: list, budget: int = INSIGHT_TOKEN_BUDGET, report: dict = None) -> list:
+    compacted = round_values(results)
+    tokens_before = estimate_tokens(dump_results(compacted))
+    notes = {}
+
+    # halve the kept rows and pairs until the results fit, topics are never dropped
+    k, max_pairs = INSIGHT_TOP_K, INSIGHT_MAX_CORRELATIONS
+    while estimate_tokens(dump_results(compacted)) > budget:
+        shrunk = []
+        for index, item in enumerate(results):
+            topic, note = compact_topic(round_values(item), k, max_pairs)
+            shrunk.append(topic)
+            if note is not None:
+                notes[index] = {"topic": item.get("topic"), **note}
+            else:
+                notes.pop(index, None)
+        compacted = shrunk
+
+        if k == 0 and max_pairs == 0:
+            break
+        k, max_pairs = k // 2, max_pairs // 2
+
+    if report is not None:
+        report.update({
+            "budget": budget,
+            "tokens_before": tokens_before,
+            "tokens_after": estimate_tokens(dump_results(compacted)),
+            "topics": list(notes.values())
+        })
+    return compacted
@@ -1,11 +1,35 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 
 from app.api.routes import router as api_router
+from app.utils import assets
+from app.utils.env import ASSET_BUILD_ON_STARTUP, LAZY_STARTUP, LOG_LEVEL
+from app.utils.lazy import lazy_import, is_loaded, warm_up
+
+# app loggers write to stderr next to the uvicorn logs
+logging.basicConfig(level=LOG_LEVEL, format="%(levelname)s:     %(name)s - %(message)s")
+
+llm = lazy_import("app.crud.openai", LAZY_STARTUP)
 
-app = FastAPI()
+# modules deferred by lazy startup, warmed once the app is serving
+WARM_MODULES = ["app.utils.config", "app.crud.file_handler", "app.crud.jobs"]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # fingerprinted asset urls, built here or ahead of time with `python -m app.utils.assets`
+    await run_in_threadpool(assets.prepare_assets, ASSET_BUILD_ON_STARTUP)
+    if LAZY_STARTUP:
+        warm_up(WARM_MODULES, setup=[lambda: llm.get_transport()])
+    yield
+    # release pooled LLM connections
+    if is_loaded("app.crud.openai"):
+        await llm.close_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 # Session Middleware
 app.add_middleware(
@@ -13,11 +37,8 @@ app.add_middleware(
     secret_key="super-secret-key"
 )
 
-# Static files (CSS, JS)
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
-
-# Templates
-templates = Jinja2Templates(directory="app/templates")
+# Static files (CSS, JS), precompressed and immutable once built
+app.mount("/static", assets.PrecompressedStaticFiles(directory="app/static"), name="static")
 
 # Include API router
 app.include_router(api_router)
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""
+Static asset pipeline.
+
+Builds minified, fingerprinted and precompressed copies of app/static into
+app/static/dist with a manifest the templates resolve through static_url():
+
+    python -m app.utils.assets
+
+Raster images are resized and re-encoded with Pillow and Brotli variants
+are written with brotli (both in requirements.txt, the build degrades to
+plain copies and gzip only without them).
+
+Read-only deployments (Vercel) cannot build at startup: run the command
+above before deploying, otherwise the unfingerprinted files are served
+with revalidation and a warning is logged at startup.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+from app.utils.env import ASSET_MAX_IMAGE_WIDTH, ASSET_JPEG_QUALITY, ASSET_PNG_COLORS
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATIC_DIR = os.path.join("app", "static")
+DIST_NAME = "dist"
+MANIFEST_NAME = "manifest.json"
+
+# text formats worth compressing, images are already compressed
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt")
+RASTER = (".png", ".jpg", ".jpeg")
+
+# precompressed variants by content coding, preferred first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# fingerprinted files never change, browsers may keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# logical path -> fingerprinted path, both relative to the static dir
+manifest = {}
+
+# strip comments and collapse whitespace
+def minify_css(text: str) -> str:
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    # spaces before ":" can be selectors ("a :hover"), only the ones after go
+    text = re.sub(r"\s*([{};,>])\s*", r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    return text.replace(";}", "}").strip()
+
+# drop comments, metadata and whitespace between tags
+def minify_svg(text: str) -> str:
+    text = re.sub(r"<!--.*?-->", "", text, flags=re.S)
+    text = re.sub(r"<metadata.*?</metadata>", "", text, flags=re.S)
+    text = re.sub(r">\s+<", "><", text)
+    return text.strip()
+
+# indentation and blank lines only, anything more needs a real parser
+# (files with template literals or continued strings are left as they are,
+# their lines may be inside a string)
+def minify_js(text: str) -> str:
+    if "`" in text or re.search(r"\\\r?$", text, flags=re.M):
+        return text
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+MINIFIERS = {".css": minify_css, ".svg": minify_svg, ".js": minify_js}
+
+# downscale and re-encode a raster image (unchanged without Pillow or if not smaller)
+def optimize_image(data: bytes, ext: str) -> bytes:
+    if Image is None:
+        return data
+
+    image = Image.open(io.BytesIO(data))
+    if image.width > ASSET_MAX_IMAGE_WIDTH:
+        height = round(image.height * ASSET_MAX_IMAGE_WIDTH / image.width)
+        image = image.resize((ASSET_MAX_IMAGE_WIDTH, height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if ext in (".jpg", ".jpeg"):
+        image.convert("RGB").save(out, "JPEG", quality=ASSET_JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        if ASSET_PNG_COLORS and image.mode in ("RGB", "RGBA"):
+            # palette png, octree keeps the alpha channel
+            method = Image.Quantize.FASTOCTREE if image.mode == "RGBA" else Image.Quantize.MEDIANCUT
+            image = image.quantize(ASSET_PNG_COLORS, method=method)
+        image.save(out, "PNG", optimize=True)
+
+    optimized = out.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+# name.ext -> name.<hash>.ext
+def fingerprint(path: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+# write through a temp file so concurrent builds never serve a partial file
+def write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+# build dist/ and the manifest, returns the manifest
+def build_assets(static_dir: str = STATIC_DIR) -> dict:
+    dist_dir = os.path.join(static_dir, DIST_NAME)
+    built = {}
+    outputs = {MANIFEST_NAME}
+
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root).startswith(os.path.abspath(dist_dir)):
+            continue
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            ext = os.path.splitext(name)[1].lower()
+
+            with open(source, "rb") as f:
+                data = f.read()
+
+            if ext in MINIFIERS:
+                data = MINIFIERS[ext](data.decode("utf-8")).encode("utf-8")
+            elif ext in RASTER:
+                data = optimize_image(data, ext)
+
+            hashed = fingerprint(logical, data)
+            write_file(os.path.join(dist_dir, hashed), data)
+            outputs.add(hashed)
+
+            if ext in COMPRESSIBLE:
+                write_file(os.path.join(dist_dir, hashed + ".gz"), gzip.compress(data, 9, mtime=0))
+                outputs.add(hashed + ".gz")
+                if brotli is not None:
+                    write_file(os.path.join(dist_dir, hashed + ".br"), brotli.compress(data, quality=11))
+                    outputs.add(hashed + ".br")
+
+            built[logical] = f"{DIST_NAME}/{hashed}"
+
+    write_file(os.path.join(dist_dir, MANIFEST_NAME), json.dumps(built, indent=2).encode("utf-8"))
+
+    # remove outputs of earlier builds
+    for root, dirs, files in os.walk(dist_dir):
+        for name in files:
+            relative = os.path.relpath(os.path.join(root, name), dist_dir).replace(os.sep, "/")
+            if relative not in outputs and not name.endswith(".tmp"):
+                os.remove(os.path.join(root, name))
+
+    manifest.clear()
+    manifest.update(built)
+    return built
+
+# load the manifest of the last build, missing means assets are served as-is
+def load_manifest(static_dir: str = STATIC_DIR) -> dict:
+    try:
+        with open(os.path.join(static_dir, DIST_NAME, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+    except (OSError, ValueError):
+        loaded = {}
+
+    manifest.clear()
+    manifest.update(loaded)
+    return manifest
+
+# fingerprinted urls at startup, mode is ASSET_BUILD_ON_STARTUP ("auto", "true" or "false")
+def prepare_assets(mode: str = "auto", static_dir: str = STATIC_DIR) -> dict:
+    if mode != "true" and load_manifest(static_dir):
+        return manifest
+
+    if mode == "true" or (mode == "auto" and os.access(static_dir, os.W_OK)):
+        try:
+            return build_assets(static_dir)
+        except OSError:
+            logger.exception("Error building static assets")
+
+    logger.warning("No asset build in %s, serving unfingerprinted static files "
+                   "(run `python -m app.utils.assets` before deploying)", os.path.join(static_dir, DIST_NAME))
+    return manifest
+
+# encodings of an Accept-Encoding header the client takes, most preferred first
+# (q=0 refuses an encoding, "*" stands for the ones not listed)
+def accepted_encodings(header: str, available: tuple) -> list:
+    qualities = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    ranked = [(qualities.get(encoding, qualities.get("*", 0.0)), encoding) for encoding in available]
+    # sorted is stable, equal qualities keep the server's order
+    return [encoding for quality, encoding in sorted(ranked, key=lambda r: -r[0]) if quality > 0]
+
+# content type of the uncompressed file
+def content_type(path: str) -> str:
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if media_type.startswith("text/"):
+        media_type += "; charset=utf-8"
+    return media_type
+
+# url of a static asset for templates, fingerprinted once built
+def static_url(path: str) -> str:
+    return "/static/" + manifest.get(path, path)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+        StaticFiles that serves .br/.gz variants of fingerprinted files when
+        the client accepts them, with long-lived immutable caching.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        relative = path.replace(os.sep, "/")
+        fingerprinted = relative.startswith(DIST_NAME + "/")
+
+        response = None
+        if fingerprinted:
+            accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""), tuple(ENCODINGS))
+            for encoding in accepted:
+                suffix = ENCODINGS[encoding]
+                full_path, stat_result = await run_in_threadpool(self.lookup_path, path + suffix)
+                if stat_result is None:
+                    continue
+
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["Content-Encoding"] = encoding
+                response.headers["Content-Type"] = content_type(relative)
+                break
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        if fingerprinted and response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    built = build_assets()
+    print(f"Built {len(built)} assets into {os.path.join(STATIC_DIR, DIST_NAME)}")
+    if Image is None:
+        print("Pillow is not installed, raster images were copied unchanged")
+    if brotli is None:
+        print("brotli is not installed, only gzip variants were written")
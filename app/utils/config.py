@@ -1,5 +1,22 @@
-TEMP_DICT = {}
+from app.utils.env import (SESSION_TTL, SESSION_MEMORY_BUDGET, SESSION_BACKEND,
+                           SESSION_DIR, SESSION_DISK_BUDGET)
+from app.utils.session_store import SessionStore, DiskSessionStore
+from app.utils.metrics import register_collector
 
-RES_DICT = {}
+# uploaded datasets, analysis results, durations and job states per session
+if SESSION_BACKEND == "disk":
+    SESSION_STORE = DiskSessionStore(SESSION_DIR, ttl=SESSION_TTL, max_bytes=SESSION_DISK_BUDGET)
+else:
+    SESSION_STORE = SessionStore(ttl=SESSION_TTL, max_bytes=SESSION_MEMORY_BUDGET)
 
-DURATION = {}
\ No newline at end of file
+# expose session count and bytes on /metrics
+def session_metrics() -> list:
+    stats = SESSION_STORE.stats()
+    return [
+        ("insightai_sessions", "gauge", "Datasets held by the session store.", [({}, stats["sessions"])]),
+        ("insightai_session_links", "gauge", "Session ids linked to a stored dataset.", [({}, stats["links"])]),
+        ("insightai_session_bytes", "gauge", "Bytes held by the session store.", [({}, stats["bytes"])]),
+        ("insightai_session_budget_bytes", "gauge", "Session store byte budget.", [({}, stats["max_bytes"])])
+    ]
+
+register_collector(session_metrics)
\ No newline at end of file
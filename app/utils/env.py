@@ -7,4 +7,94 @@ BASE_URL = os.getenv("BASE_URL")
 API_KEY = os.getenv("API_KEY")
 
 if not BASE_URL or not API_KEY:
-    raise ValueError("BASE_URL and API_KEY must be set in environment variables.")
\ No newline at end of file
+    raise ValueError("BASE_URL and API_KEY must be set in environment variables.")
+
+# level of the app's error and warning logs
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+
+# LLM client settings
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+
+# LLM scheduler: concurrency cap, token bucket (0 tokens per minute disables it) and wait queue size
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", 100))
+# completion size assumed before any response has been seen
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", 500))
+
+# LLM transport: "openai" (default), "record" to save responses, "replay" to serve them offline
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT", "openai").lower()
+LLM_FIXTURES_DIR = os.getenv("LLM_FIXTURES_DIR", "app/lib/fixtures")
+LLM_REPLAY_LATENCY_MS = float(os.getenv("LLM_REPLAY_LATENCY_MS", 0))
+LLM_REPLAY_JITTER_MS = float(os.getenv("LLM_REPLAY_JITTER_MS", 0))
+LLM_REPLAY_DISTRIBUTION = os.getenv("LLM_REPLAY_DISTRIBUTION", "fixed").lower()
+LLM_REPLAY_ERROR_RATE = float(os.getenv("LLM_REPLAY_ERROR_RATE", 0))
+LLM_REPLAY_ERROR_KINDS = os.getenv("LLM_REPLAY_ERROR_KINDS", "timeout").split(",")
+
+# analysis job settings
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 4))
+
+# LLM response cache settings (disk layer is disabled unless LLM_CACHE_DIR is set)
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 256))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 86400))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+
+# session store settings
+SESSION_TTL = float(os.getenv("SESSION_TTL", 1800))
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", 1024 * 1024 * 1024))
+
+# "memory" for single-process dev, "disk" to share sessions across workers (requires pyarrow)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_DIR = os.getenv("SESSION_DIR", "/tmp/insightai-sessions")
+SESSION_DISK_BUDGET = int(os.getenv("SESSION_DISK_BUDGET", 5 * 1024 * 1024 * 1024))
+
+# upload limits
+MAX_ROWS = int(os.getenv("MAX_ROWS", 25000))
+MAX_COLUMNS = int(os.getenv("MAX_COLUMNS", 500))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+
+# store free-text columns as Arrow-backed strings (requires pyarrow)
+USE_ARROW_STRINGS = os.getenv("USE_ARROW_STRINGS", "false").lower() == "true"
+
+# uploads are parsed on a thread pool off the event loop
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 2))
+# "auto" uses calamine when python-calamine is installed, else the pandas default (openpyxl)
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "auto").lower()
+
+# large-file mode: csv over the limits is aggregated chunk by chunk from disk
+LARGE_FILE_MODE = os.getenv("LARGE_FILE_MODE", "false").lower() == "true"
+LARGE_FILE_DIR = os.getenv("LARGE_FILE_DIR", "/tmp/insightai-uploads")
+LARGE_FILE_MAX_BYTES = int(os.getenv("LARGE_FILE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+LARGE_SAMPLE_ROWS = int(os.getenv("LARGE_SAMPLE_ROWS", 10000))
+LARGE_CHUNK_ROWS = int(os.getenv("LARGE_CHUNK_ROWS", 100000))
+MEDIAN_SKETCH_SIZE = int(os.getenv("MEDIAN_SKETCH_SIZE", 1024))
+
+# insight prompt budget: results are compacted until the prompt fits
+INSIGHT_TOKEN_BUDGET = int(os.getenv("INSIGHT_TOKEN_BUDGET", 2000))
+INSIGHT_TOP_K = int(os.getenv("INSIGHT_TOP_K", 5))
+INSIGHT_MAX_CORRELATIONS = int(os.getenv("INSIGHT_MAX_CORRELATIONS", 10))
+INSIGHT_DECIMALS = int(os.getenv("INSIGHT_DECIMALS", 2))
+
+# intent topics run on a shared thread pool (0 runs them in order on the job thread, without timeouts)
+TOPIC_WORKERS = int(os.getenv("TOPIC_WORKERS", min(4, os.cpu_count() or 1)))
+TOPIC_TIMEOUT = float(os.getenv("TOPIC_TIMEOUT", 30))
+
+# line charts are downsampled to this many points by /chart
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", 500))
+
+# lazy startup: pandas, the LLM SDK and clients load on first use and are warmed in the background
+# (on by default on Vercel, where every cold start pays for the imports)
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "true" if os.getenv("VERCEL") else "false").lower() == "true"
+
+# static assets: fingerprinted, precompressed copies are built into app/static/dist
+# "auto" builds at startup when there is no build yet and app/static is writable,
+# "true" always rebuilds, "false" only uses a build made ahead of time
+ASSET_BUILD_ON_STARTUP = os.getenv("ASSET_BUILD_ON_STARTUP", "auto").lower()
+ASSET_MAX_IMAGE_WIDTH = int(os.getenv("ASSET_MAX_IMAGE_WIDTH", 1600))
+ASSET_JPEG_QUALITY = int(os.getenv("ASSET_JPEG_QUALITY", 80))
+# png palette size (0 keeps full color)
+ASSET_PNG_COLORS = int(os.getenv("ASSET_PNG_COLORS", 256))
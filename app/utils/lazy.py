@@ -0,0 +1,58 @@
+import importlib
+import logging
+import sys
+import threading
+
+from app.utils.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# serializes first imports triggered from request threads and the warm-up thread
+import_lock = threading.RLock()
+
+
+class LazyModule:
+    """
+        Stand-in for a module that is imported on first attribute access.
+        Lets static pages answer without paying for pandas and the LLM SDK
+        on a cold start.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def load(self):
+        if self.module is None:
+            with import_lock:
+                self.module = importlib.import_module(self.name)
+        return self.module
+
+
+# module now, or a lazy stand-in when lazy is set
+def lazy_import(name: str, lazy: bool = True):
+    return LazyModule(name) if lazy else importlib.import_module(name)
+
+# module already imported (by a lazy stand-in or anywhere else)
+def is_loaded(name: str) -> bool:
+    return name in sys.modules
+
+# import modules and run setup calls in the background, timed as the "warmup" stage
+def warm_up(names: list, setup: list = None) -> threading.Thread:
+    def run():
+        try:
+            with span("warmup"):
+                with import_lock:
+                    for name in names:
+                        importlib.import_module(name)
+                for call in setup or []:
+                    call()
+        except Exception:
+            logger.exception("Error warming up")
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# metrics and collectors rendered by /metrics
+REGISTRY = []
+COLLECTORS = []
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{escape(str(value))}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """
+        Monotonic counter with optional labels (Prometheus text format).
+    """
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+        Cumulative histogram with optional labels (Prometheus text format).
+    """
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in self.values.items():
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series['count']}")
+        return lines
+
+
+# register a function returning (name, type, help, [(labels dict, value)]) for values read at scrape time
+def register_collector(collector):
+    COLLECTORS.append(collector)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+
+    for collector in COLLECTORS:
+        try:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+        except Exception:
+            logger.exception("Error collecting metrics")
+
+    return "\n".join(lines) + "\n"
+
+
+# pipeline metrics
+STAGE_SECONDS = Histogram("insightai_stage_seconds", "Duration of analysis pipeline stages.")
+TOPIC_SECONDS = Histogram("insightai_topic_seconds", "Duration of executing one analysis topic.")
+FAILED_TOPICS = Counter("insightai_failed_topics_total", "Analysis topics skipped because of an error.")
+JOB_RESULTS = Counter("insightai_jobs_total", "Finished analysis jobs by status.")
+LLM_TOKENS = Counter("insightai_llm_tokens_total", "Tokens used by upstream LLM calls.")
+LLM_REQUESTS = Counter("insightai_llm_requests_total", "LLM calls by prompt kind and source.")
+LLM_QUEUE_SECONDS = Histogram("insightai_llm_queue_seconds", "Time LLM calls waited for the scheduler.")
+LLM_REJECTED = Counter("insightai_llm_rejected_total", "LLM calls rejected because the wait queue was full.")
+UPLOADS = Counter("insightai_uploads_total", "Accepted uploads, new or shared with an identical dataset.")
+
+
+# time a block, observed in the stage histogram and written to timings if given
+@contextmanager
+def span(stage: str, timings: dict = None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0) + elapsed, 6)
@@ -0,0 +1,727 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+
+# file locks between worker processes (not available on Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetKey(str):
+    """
+        Key of a stored dataset as handed out by resolve(). Only keys of this
+        type address a dataset directly; plain strings (cookies, urls) are
+        session ids and go through their link.
+    """
+
+
+class SessionStore:
+    """
+        In-memory store for uploaded datasets and their analysis results.
+        Each record keeps the DataFrame, results and duration together.
+        Session ids link to a dataset key (the content hash of the upload),
+        so identical uploads share one record; it is dropped when the last
+        linked session is deleted.
+        Idle datasets expire after ttl seconds and least recently used
+        datasets are evicted when the total DataFrame memory exceeds max_bytes.
+    """
+
+    def __init__(self, ttl: float = 1800, max_bytes: int = 1024 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sessions = OrderedDict()
+        self.links = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.evict_callbacks = []
+
+    def __contains__(self, clean_id: str) -> bool:
+        return self.get(clean_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    # register a function called with the dataset key whenever a dataset is dropped
+    def on_evict(self, callback):
+        self.evict_callbacks.append(callback)
+
+    # dataset key of a session id (dataset keys resolve to themselves for jobs)
+    def resolve(self, clean_id: str) -> DatasetKey:
+        if clean_id is None:
+            return None
+        with self.lock:
+            return self.resolve_locked(clean_id)
+
+    def resolve_locked(self, clean_id: str) -> str:
+        if isinstance(clean_id, DatasetKey):
+            return clean_id if clean_id in self.sessions else None
+        key = self.links.get(clean_id)
+        return DatasetKey(key) if key is not None else None
+
+    # link a session to a stored dataset, creating it from df when missing or failed
+    def create(self, clean_id: str, df: pd.DataFrame, key: str = None):
+        key = key or clean_id
+        with self.lock:
+            self.unlink_locked(clean_id)
+            record = self.sessions.get(key)
+            if record is not None and not is_failed(record):
+                self.link_locked(clean_id, key)
+                return
+
+            refs = record["refs"] if record is not None else 0
+            if record is not None:
+                self.remove_locked(key, keep_links=True)
+
+            size = df_size(df)
+            self.sessions[key] = {
+                "df": df,
+                "results": None,
+                "duration": None,
+                "job": None,
+                "bytes": size,
+                "refs": refs,
+                "last_access": time.time()
+            }
+            self.total_bytes += size
+            self.link_locked(clean_id, key)
+            evicted = self.evict_locked(keep=key)
+
+        self.notify(evicted)
+
+    # link a new session to an existing dataset, False if there is none to share
+    def link(self, clean_id: str, key: str) -> bool:
+        with self.lock:
+            record = self.sessions.get(key)
+            # a failed analysis is redone rather than shared
+            if record is None or is_failed(record):
+                return False
+            self.link_locked(clean_id, key)
+        return True
+
+    def link_locked(self, clean_id: str, key: str):
+        self.links[clean_id] = key
+        record = self.sessions[key]
+        record["refs"] += 1
+        record["last_access"] = time.time()
+        self.sessions.move_to_end(key)
+
+    # drop a session link, returns the dataset key if it has no sessions left
+    def unlink_locked(self, clean_id: str) -> str:
+        key = self.links.pop(clean_id, None)
+        record = self.sessions.get(key) if key is not None else None
+        if record is None:
+            return None
+        record["refs"] -= 1
+        return key if record["refs"] <= 0 else None
+
+    # move a session onto its own dataset (keyed by the session id) before its results are edited;
+    # the content-addressed dataset stays as uploaded for other and later identical uploads
+    # (the dataframe is shared, updates replace it rather than modify it)
+    def fork(self, clean_id: str) -> DatasetKey:
+        with self.lock:
+            key = self.resolve_locked(clean_id)
+            record = self.sessions.get(key) if key is not None else None
+            if record is None or key == clean_id:
+                return key
+
+            # the frame is shared, not copied, its bytes stay with the uploaded dataset
+            self.sessions[clean_id] = dict(record, refs=0, bytes=0)
+            orphan = self.unlink_locked(clean_id)
+            self.link_locked(clean_id, clean_id)
+
+            # the session was the last one on the uploaded dataset
+            evicted = [orphan] if orphan is not None and self.remove_locked(orphan) else []
+            evicted += self.evict_locked(keep=clean_id)
+
+        self.notify(evicted)
+        return DatasetKey(clean_id)
+
+    def get(self, clean_id: str) -> dict:
+        if clean_id is None:
+            return None
+
+        with self.lock:
+            evicted = self.expire_locked()
+            key = self.resolve_locked(clean_id)
+            record = self.sessions.get(key) if key is not None else None
+            if record is not None:
+                record["last_access"] = time.time()
+                self.sessions.move_to_end(key)
+
+        self.notify(evicted)
+        return record
+
+    def get_df(self, clean_id: str) -> pd.DataFrame:
+        record = self.get(clean_id)
+        return record["df"] if record is not None else None
+
+    # record without loading the dataframe (same as get in memory)
+    def get_meta(self, clean_id: str) -> dict:
+        return self.get(clean_id)
+
+    # update fields of an existing dataset, returns False if it expired
+    # or when(record) is given and false (checked and updated atomically)
+    def update(self, clean_id: str, when=None, **fields) -> bool:
+        with self.lock:
+            key = self.resolve_locked(clean_id)
+            record = self.sessions.get(key) if key is not None else None
+            if record is None or (when is not None and not when(record)):
+                return False
+
+            if "df" in fields:
+                size = df_size(fields["df"])
+                self.release_locked(record)
+                self.total_bytes += size
+                record["bytes"] = size
+
+            record.update(fields)
+            record["last_access"] = time.time()
+            self.sessions.move_to_end(key)
+            evicted = self.evict_locked(keep=key)
+
+        self.notify(evicted)
+        return True
+
+    # drop a session, returns True if its dataset was removed with it
+    def delete(self, clean_id: str) -> bool:
+        with self.lock:
+            key = self.unlink_locked(clean_id)
+            removed = key is not None and self.remove_locked(key)
+
+        if removed:
+            self.notify([key])
+        return removed
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "links": len(self.links),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def remove_locked(self, key: str, keep_links: bool = False) -> bool:
+        record = self.sessions.pop(key, None)
+        if record is None:
+            return False
+        self.release_locked(record)
+
+        # sessions of an evicted dataset expire with it
+        if not keep_links and record["refs"] > 0:
+            for clean_id in [c for c, k in self.links.items() if k == key]:
+                del self.links[clean_id]
+        return True
+
+    # bytes of a record's frame go to a forked dataset still holding it, or are freed
+    def release_locked(self, record: dict):
+        df = record["df"]
+        heir = next((other for other in self.sessions.values()
+                     if other is not record and df is not None and other["df"] is df), None)
+        if heir is not None:
+            heir["bytes"] += record["bytes"]
+        else:
+            self.total_bytes -= record["bytes"]
+        record["bytes"] = 0
+
+    def expire_locked(self) -> list:
+        # datasets are ordered by last access, oldest first
+        cutoff = time.time() - self.ttl
+        expired = []
+        for key, record in self.sessions.items():
+            if record["last_access"] >= cutoff:
+                break
+            expired.append(key)
+
+        for key in expired:
+            self.remove_locked(key)
+        return expired
+
+    def evict_locked(self, keep: str = None) -> list:
+        evicted = self.expire_locked()
+
+        # drop least recently used datasets until within the memory budget
+        for key in list(self.sessions.keys()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.remove_locked(key)
+            evicted.append(key)
+
+        return evicted
+
+    def notify(self, keys: list):
+        for key in keys:
+            for callback in self.evict_callbacks:
+                try:
+                    callback(key)
+                except Exception:
+                    logger.exception("Error evicting session '%s'", key)
+
+
+class DiskSessionStore:
+    """
+        Session store shared by all workers through a local directory.
+        Each dataset is a folder with the DataFrame as an Arrow IPC file
+        (memory-mapped on read) and the remaining fields as meta.json.
+        Session ids are link files under .links naming their dataset, and
+        each linked session holds a file under the dataset's refs folder.
+        Updates rewrite meta.json under a file lock shared by the workers.
+        Idle datasets expire after ttl seconds and least recently used
+        datasets are removed when the directory exceeds max_bytes.
+    """
+
+    DATA_FILE = "data.arrow"
+    PICKLE_FILE = "data.pkl"
+    META_FILE = "meta.json"
+    LOCK_FILE = "meta.lock"
+    REFS_DIR = "refs"
+    LINKS_DIR = ".links"
+
+    def __init__(self, directory: str, ttl: float = 1800, max_bytes: int = 5 * 1024 * 1024 * 1024,
+                 cache_size: int = 4, sweep_interval: float = 30):
+        import pyarrow
+
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0
+        self.lock = threading.RLock()
+        self.evict_callbacks = []
+
+        # per-process cache of loaded dataframes keyed by data file mtime
+        self.frames = OrderedDict()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __contains__(self, clean_id: str) -> bool:
+        return self.get_meta(clean_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.session_ids())
+
+    def on_evict(self, callback):
+        self.evict_callbacks.append(callback)
+
+    def path(self, clean_id: str, name: str = None) -> str:
+        # clean_id comes from cookies and urls, never let it leave the directory
+        if not clean_id or os.path.basename(clean_id) != clean_id or clean_id.startswith("."):
+            raise KeyError(clean_id)
+        folder = os.path.join(self.directory, clean_id)
+        return os.path.join(folder, name) if name else folder
+
+    def session_ids(self) -> list:
+        # dot names are the links folder and forks being copied
+        return [name for name in os.listdir(self.directory)
+                if not name.startswith(".") and os.path.isfile(os.path.join(self.directory, name, self.META_FILE))]
+
+    # link file of a session id, holding its dataset key
+    def link_path(self, clean_id: str) -> str:
+        if not clean_id or os.path.basename(clean_id) != clean_id or clean_id.startswith("."):
+            raise KeyError(clean_id)
+        return os.path.join(self.directory, self.LINKS_DIR, clean_id)
+
+    # dataset key of a session id (dataset keys resolve to themselves for jobs)
+    def resolve(self, clean_id: str) -> DatasetKey:
+        if clean_id is None:
+            return None
+
+        if isinstance(clean_id, DatasetKey):
+            key = clean_id
+        else:
+            try:
+                with open(self.link_path(clean_id), "r", encoding="utf-8") as f:
+                    key = f.read().strip()
+            except (KeyError, OSError):
+                return None
+
+        try:
+            exists = os.path.isfile(self.path(key, self.META_FILE))
+        except KeyError:
+            return None
+        return DatasetKey(key) if exists else None
+
+    # link a session to a stored dataset, creating it from df when missing or failed
+    def create(self, clean_id: str, df: pd.DataFrame, key: str = None):
+        key = key or clean_id
+        folder = self.path(key)
+
+        with self.lock:
+            self.unlink(clean_id)
+            if self.link(clean_id, key):
+                return
+
+            # a failed dataset keeps the sessions linked to it
+            if not os.path.isfile(self.path(key, self.META_FILE)):
+                shutil.rmtree(folder, ignore_errors=True)
+            os.makedirs(os.path.join(folder, self.REFS_DIR), exist_ok=True)
+
+            size = self.write_df(key, df)
+            self.write_meta(key, {
+                "results": None,
+                "duration": None,
+                "job": None,
+                "bytes": size
+            })
+            self.add_link(clean_id, key)
+
+        self.sweep(keep=key, force=True)
+
+    # link a new session to an existing dataset, False if there is none to share
+    def link(self, clean_id: str, key: str) -> bool:
+        record = self.get_meta(DatasetKey(key))
+        # a failed analysis is redone rather than shared
+        if record is None or is_failed(record):
+            return False
+        self.add_link(clean_id, key)
+        return True
+
+    def add_link(self, clean_id: str, key: str):
+        os.makedirs(os.path.join(self.directory, self.LINKS_DIR), exist_ok=True)
+        os.makedirs(self.path(key, self.REFS_DIR), exist_ok=True)
+        with open(self.path(key, os.path.join(self.REFS_DIR, clean_id)), "w", encoding="utf-8"):
+            pass
+
+        link_path = self.link_path(clean_id)
+        tmp_path = f"{link_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(key)
+        os.replace(tmp_path, link_path)
+
+    # drop a session link, returns the dataset key if it has no sessions left
+    def unlink(self, clean_id: str) -> str:
+        try:
+            link_path = self.link_path(clean_id)
+            with open(link_path, "r", encoding="utf-8") as f:
+                key = f.read().strip()
+            os.remove(link_path)
+            refs = self.path(key, self.REFS_DIR)
+        except (KeyError, OSError):
+            return None
+
+        try:
+            os.remove(os.path.join(refs, clean_id))
+        except OSError:
+            pass
+
+        try:
+            return None if os.listdir(refs) else key
+        except OSError:
+            return key
+
+    # move a session onto its own dataset (keyed by the session id) before its results are edited;
+    # the content-addressed dataset stays as uploaded for other and later identical uploads
+    # (files are hard linked, they are only ever replaced, never written in place)
+    def fork(self, clean_id: str) -> DatasetKey:
+        with self.lock:
+            key = self.resolve(clean_id)
+            if key is None or key == clean_id:
+                return key
+
+            # copied next to the store and renamed, a worker forking the same session at once loses the rename
+            folder = self.path(clean_id)
+            tmp_folder = os.path.join(self.directory, f".fork.{clean_id}.{os.getpid()}.{threading.get_ident()}")
+            try:
+                shutil.copytree(self.path(key), tmp_folder, copy_function=link_or_copy,
+                                ignore=shutil.ignore_patterns(self.REFS_DIR, self.LOCK_FILE, "*.tmp"))
+                os.rename(tmp_folder, folder)
+            except OSError:
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+                if os.path.isfile(self.path(clean_id, self.META_FILE)):
+                    return DatasetKey(clean_id)
+                logger.exception("Error copying session data of '%s'", key)
+                return None
+
+            orphan = self.unlink(clean_id)
+            self.add_link(clean_id, clean_id)
+
+        # the session was the last one on the uploaded dataset
+        if orphan is not None:
+            self.remove(orphan)
+        self.sweep(keep=clean_id, force=True)
+        return DatasetKey(clean_id)
+
+    def get(self, clean_id: str) -> dict:
+        key = self.resolve(clean_id)
+        record = self.get_meta(key)
+        if record is None:
+            return None
+
+        df = self.read_df(key)
+        if df is None:
+            return None
+
+        record["df"] = df
+        return record
+
+    def get_df(self, clean_id: str) -> pd.DataFrame:
+        record = self.get(clean_id)
+        return record["df"] if record is not None else None
+
+    def get_meta(self, clean_id: str) -> dict:
+        if clean_id is None:
+            return None
+
+        self.sweep()
+
+        try:
+            key = self.resolve(clean_id)
+            meta_path = self.path(key, self.META_FILE)
+            with open(meta_path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            # mtime of meta.json is the last access time
+            os.utime(meta_path)
+        except (KeyError, OSError, ValueError):
+            return None
+
+        record["last_access"] = time.time()
+        return record
+
+    # update fields of an existing dataset, returns False if it expired
+    # or when(record) is given and false (checked and updated atomically)
+    def update(self, clean_id: str, when=None, **fields) -> bool:
+        key = self.resolve(clean_id)
+        try:
+            # read, modify and write meta.json under the dataset lock so
+            # concurrent workers do not overwrite each other's fields
+            with self.meta_lock(key):
+                meta_path = self.path(key, self.META_FILE)
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+                if when is not None and not when(record):
+                    return False
+
+                if "df" in fields:
+                    record["bytes"] = self.write_df(key, fields.pop("df"))
+
+                record.update(fields)
+                self.write_meta(key, record)
+        except (KeyError, OSError, ValueError):
+            return False
+
+        self.sweep(keep=key)
+        return True
+
+    # drop a session, returns True if its dataset was removed with it
+    def delete(self, clean_id: str) -> bool:
+        with self.lock:
+            key = self.unlink(clean_id)
+        return key is not None and self.remove(key)
+
+    # remove a dataset no session links to any more
+    def remove(self, key: str) -> bool:
+        with self.lock:
+            self.frames.pop(key, None)
+
+        folder = self.path(key)
+        if not os.path.isdir(folder):
+            return False
+
+        shutil.rmtree(folder, ignore_errors=True)
+        self.notify([key])
+        return True
+
+    def stats(self) -> dict:
+        sessions = self.scan()
+        try:
+            links = len(os.listdir(os.path.join(self.directory, self.LINKS_DIR)))
+        except OSError:
+            links = 0
+        return {
+            "sessions": len(sessions),
+            "links": links,
+            "bytes": sum(size for _, size, _ in sessions),
+            "max_bytes": self.max_bytes
+        }
+
+    # exclusive lock on a dataset across threads and worker processes
+    @contextmanager
+    def meta_lock(self, key: str):
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+
+            with open(self.path(key, self.LOCK_FILE), "a", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def write_meta(self, clean_id: str, record: dict):
+        meta_path = self.path(clean_id, self.META_FILE)
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, default=str)
+        os.replace(tmp_path, meta_path)
+
+    def write_df(self, clean_id: str, df: pd.DataFrame) -> int:
+        import pyarrow as pa
+
+        data_path = self.path(clean_id, self.DATA_FILE)
+        pickle_path = self.path(clean_id, self.PICKLE_FILE)
+        tmp_path = f"{data_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            table = pa.Table.from_pandas(df)
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, data_path)
+            if os.path.exists(pickle_path):
+                os.remove(pickle_path)
+            path = data_path
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            # columns arrow cannot represent (mixed objects) fall back to pickle
+            logger.warning("Error writing arrow data for '%s', using pickle: %s", clean_id, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            df.to_pickle(pickle_path)
+            if os.path.exists(data_path):
+                os.remove(data_path)
+            path = pickle_path
+
+        with self.lock:
+            self.frames.pop(clean_id, None)
+
+        return os.path.getsize(path)
+
+    def read_df(self, clean_id: str) -> pd.DataFrame:
+        import pyarrow as pa
+
+        for name in (self.DATA_FILE, self.PICKLE_FILE):
+            path = self.path(clean_id, name)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+
+            with self.lock:
+                cached = self.frames.get(clean_id)
+                if cached is not None and cached[0] == (name, mtime):
+                    self.frames.move_to_end(clean_id)
+                    return cached[1]
+
+            try:
+                if name == self.DATA_FILE:
+                    # numeric columns without nulls stay backed by the shared mapping
+                    source = pa.memory_map(path, "r")
+                    df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+                else:
+                    df = pd.read_pickle(path)
+            except (OSError, pa.ArrowException) as e:
+                logger.exception("Error reading session data for '%s'", clean_id)
+                return None
+
+            with self.lock:
+                self.frames[clean_id] = ((name, mtime), df)
+                self.frames.move_to_end(clean_id)
+                while len(self.frames) > self.cache_size:
+                    self.frames.popitem(last=False)
+
+            return df
+
+        return None
+
+    def scan(self) -> list:
+        # (last access, bytes, clean_id) per session
+        sessions = []
+        for clean_id in self.session_ids():
+            folder = os.path.join(self.directory, clean_id)
+            try:
+                last_access = os.stat(os.path.join(folder, self.META_FILE)).st_mtime
+                # files hard linked into forked datasets are shared, not copied
+                size = sum(stat.st_size // max(stat.st_nlink, 1)
+                           for stat in (entry.stat() for entry in os.scandir(folder) if entry.is_file()))
+            except OSError:
+                continue
+            sessions.append((last_access, size, clean_id))
+        return sessions
+
+    def sweep(self, keep: str = None, force: bool = False):
+        now = time.time()
+        if not force and now - self.last_sweep < self.sweep_interval:
+            return
+        self.last_sweep = now
+
+        sessions = sorted(self.scan())
+        total = sum(size for _, size, _ in sessions)
+        evicted = []
+
+        for last_access, size, clean_id in sessions:
+            if clean_id == keep:
+                continue
+            # expire idle sessions, then drop oldest until within budget
+            if now - last_access > self.ttl or total > self.max_bytes:
+                shutil.rmtree(os.path.join(self.directory, clean_id), ignore_errors=True)
+                total -= size
+                evicted.append(clean_id)
+
+        with self.lock:
+            for clean_id in evicted:
+                self.frames.pop(clean_id, None)
+
+        # sessions of an evicted dataset expire with it
+        if evicted or force:
+            self.sweep_links()
+
+        self.notify(evicted)
+
+    def sweep_links(self):
+        links_dir = os.path.join(self.directory, self.LINKS_DIR)
+        try:
+            names = os.listdir(links_dir)
+        except OSError:
+            return
+
+        for clean_id in names:
+            link_path = os.path.join(links_dir, clean_id)
+            try:
+                with open(link_path, "r", encoding="utf-8") as f:
+                    key = f.read().strip()
+                if not os.path.isfile(self.path(key, self.META_FILE)):
+                    os.remove(link_path)
+            except (KeyError, OSError):
+                continue
+
+    def notify(self, clean_ids: list):
+        for clean_id in clean_ids:
+            for callback in self.evict_callbacks:
+                try:
+                    callback(clean_id)
+                except Exception:
+                    logger.exception("Error evicting session '%s'", clean_id)
+
+
+# analysis of a record failed, its dataset is not shared
+def is_failed(record: dict) -> bool:
+    job = record.get("job")
+    return job is not None and job.get("status") == "failed"
+
+# hard link a file, copy it where links are not supported
+def link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+# memory used by a dataframe including object values
+def df_size(df: pd.DataFrame) -> int:
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
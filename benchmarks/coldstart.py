@@ -0,0 +1,128 @@
+"""
+    Cold-start profile of the app entry point (app/main.py, the Vercel entry).
+
+    Usage:
+        python -m benchmarks.coldstart
+        python -m benchmarks.coldstart --runs 5 --top 15 --json coldstart.json
+
+    Every run is a fresh interpreter started with `-X importtime`, once with
+    eager imports and once with LAZY_STARTUP=true. Reported per mode (median
+    over runs): time to import app.main, time to answer the first GET /
+    (lifespan not run, as on a serverless cold start), whether pandas and
+    the OpenAI SDK were loaded by then, and the slowest imports by
+    cumulative time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODES = {"eager": "false", "lazy": "true"}
+HEAVY_MODULES = ["pandas", "openai"]
+
+# runs in the child interpreter, prints one json line
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter() - start
+
+from starlette.testclient import TestClient
+client = TestClient(app.main.app)
+start = time.perf_counter()
+status = client.get("/").status_code
+first_request = time.perf_counter() - start
+
+print(json.dumps({
+    "import_seconds": imported,
+    "first_request_seconds": first_request,
+    "status": status,
+    "loaded": {name: name in sys.modules for name in %r}
+}))
+""" % (HEAVY_MODULES,)
+
+
+# (module, cumulative seconds) from -X importtime output, slowest first
+def parse_importtime(stderr: str) -> list:
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            modules.append((name.strip(), int(cumulative) / 1e6))
+        except ValueError:
+            continue
+    return sorted(modules, key=lambda item: item[1], reverse=True)
+
+
+def run_once(lazy: str) -> dict:
+    env = dict(os.environ, LAZY_STARTUP=lazy)
+    # app.utils.env requires these, nothing is sent to them
+    env.setdefault("BASE_URL", "http://localhost.invalid")
+    env.setdefault("API_KEY", "offline-benchmark")
+
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+
+def profile(mode: str, runs: int, top: int) -> dict:
+    results = [run_once(MODES[mode]) for _ in range(runs)]
+
+    # slowest imports of the median run
+    results.sort(key=lambda r: r["import_seconds"])
+    median = results[len(results) // 2]
+
+    return {
+        "mode": mode,
+        "runs": runs,
+        "import_seconds": statistics.median(r["import_seconds"] for r in results),
+        "first_request_seconds": statistics.median(r["first_request_seconds"] for r in results),
+        "loaded": median["loaded"],
+        "top_imports": [{"module": name, "seconds": seconds}
+                        for name, seconds in median["imports"][:top]]
+    }
+
+
+def print_report(reports: list):
+    print(f"{'mode':<8}{'import s':>12}{'first GET / s':>16}  loaded")
+    for report in reports:
+        loaded = ", ".join(name for name, on in report["loaded"].items() if on) or "-"
+        print(f"{report['mode']:<8}{report['import_seconds']:>12.3f}"
+              f"{report['first_request_seconds']:>16.3f}  {loaded}")
+
+    for report in reports:
+        print(f"\nslowest imports ({report['mode']}):")
+        for item in report["top_imports"]:
+            print(f"  {item['seconds']:>8.3f}  {item['module']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold-start import profile of the InsightAI app.")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    reports = [profile(mode, args.runs, args.top) for mode in args.modes]
+    print_report(reports)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
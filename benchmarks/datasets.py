@@ -0,0 +1,122 @@
+import calendar
+import io
+
+import numpy as np
+import pandas as pd
+
+# column type mixes available to the benchmark matrix
+MIXES = ["monthly", "numeric", "months", "dates", "text", "mixed"]
+
+COUNTRIES = ["South Korea", "United States", "Japan", "Canada", "Australia", "Taiwan",
+             "Germany", "France", "Brazil", "India", "Peru", "Chad"]
+REGIONS = ["north", "south", "east", "west", "central"]
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel",
+         "india", "juliet", "kilo", "lima", "mike", "november", "oscar", "papa"]
+
+month_names = list(calendar.month_name)[1:]
+month_lower = [m.lower() for m in month_names]
+
+
+def numeric_column(rng, rows, i):
+    if i % 2 == 0:
+        return rng.integers(0, 10000, rows)
+    return rng.normal(100, 25, rows).round(3)
+
+
+def text_column(rng, rows, distinct):
+    words = rng.choice(WORDS, size=(rows, 3))
+    pool = np.array([" ".join(w) for w in words[:distinct]])
+    return rng.choice(pool, rows)
+
+
+# build a synthetic dataset for a type mix, values are raw (as read from a file)
+def make_dataset(rows: int, cols: int, mix: str, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {}
+
+    if mix == "monthly":
+        # same shape as the exports behind app/lib/TEST_INTRES*.json
+        data["Country"] = rng.choice(COUNTRIES, rows)
+        for i, month in enumerate(month_names[:max(cols - 2, 1)]):
+            data[month] = rng.integers(0, 5000, rows)
+        data["Total"] = sum(data[m] for m in month_names[:max(cols - 2, 1)])
+        return pd.DataFrame(data)
+
+    data["Region"] = rng.choice(REGIONS, rows)
+
+    for i in range(cols - 1):
+        kind = mix
+        if mix == "mixed":
+            kind = ["numeric", "months", "dates", "text"][i % 4]
+
+        name = f"{kind}_{i}"
+        if kind == "numeric":
+            data[name] = numeric_column(rng, rows, i)
+        elif kind == "months":
+            data[name] = rng.choice(month_names if i % 2 == 0 else [m[:3] for m in month_names], rows)
+        elif kind == "dates":
+            start = np.datetime64("2020-01-01")
+            days = rng.integers(0, 365 * 4, rows)
+            fmt = "%Y-%m-%d" if i % 2 == 0 else "%m/%d/%Y"
+            data[name] = pd.Series(start + days).dt.strftime(fmt)
+        else:
+            data[name] = text_column(rng, rows, distinct=min(rows, 50 if i % 2 == 0 else 5000))
+
+    return pd.DataFrame(data)
+
+
+# serialize dataset to upload bytes
+def to_bytes(df: pd.DataFrame, fmt: str) -> bytes:
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+# canned intents for a cleaned dataset, shaped like the LLM output
+def make_intents(df: pd.DataFrame, mix: str) -> list:
+    if mix == "monthly":
+        return None
+
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])
+               and not c.endswith(("_year", "_month", "_weekday"))]
+    categorical = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])
+                   and not pd.api.types.is_datetime64_any_dtype(df[c])]
+    group_by = categorical[0] if categorical else None
+    measure = numeric[0] if numeric else None
+
+    def intent(**kwargs):
+        base = {"topic": "", "aggregation": None, "measure": None, "group_by": None,
+                "filters": None, "relationship": None, "sort_by": None,
+                "ascending": None, "limit": None}
+        base.update(kwargs)
+        return base
+
+    intents = []
+    if measure and group_by:
+        intents.append(intent(topic=f"Top {group_by} by total {measure}", aggregation="sum",
+                              measure=measure, group_by=group_by, sort_by=measure,
+                              ascending=False, limit=5))
+        intents.append(intent(topic=f"Average {measure} by {group_by}", aggregation="mean",
+                              measure=measure, group_by=group_by))
+        intents.append(intent(topic=f"Median {measure} by {group_by}", aggregation="median",
+                              measure=measure, group_by=group_by))
+    if len(numeric) >= 2:
+        intents.append(intent(topic="Relationship between measures", relationship="correlation",
+                              measure=numeric[:4]))
+    if len(categorical) >= 2 and measure:
+        intents.append(intent(topic=f"Count by {categorical[1]}", aggregation="count",
+                              measure=measure, group_by=categorical[1],
+                              sort_by=measure, ascending=False, limit=10))
+    if len(categorical) >= 2:
+        # text measures end up as compacted categories
+        for agg in ("min", "max"):
+            intents.append(intent(topic=f"{agg.title()} {categorical[1]} by {group_by}", aggregation=agg,
+                                  measure=categorical[1], group_by=group_by))
+    if not intents and group_by:
+        intents.append(intent(topic=f"Rows per {group_by}", aggregation="count",
+                              measure=df.columns[-1], group_by=group_by))
+
+    return intents
@@ -0,0 +1,234 @@
+"""
+    Concurrent load driver for the /upload -> /clean -> /report flow.
+
+    Usage (in-process app with the replay LLM transport):
+        python -m benchmarks.load --users 20 --iterations 3
+        LLM_REPLAY_LATENCY_MS=1500 LLM_REPLAY_JITTER_MS=500 LLM_REPLAY_DISTRIBUTION=lognormal \\
+            LLM_REPLAY_ERROR_RATE=0.05 python -m benchmarks.load --users 50
+
+    Against a running server (start it with LLM_TRANSPORT=replay):
+        python -m benchmarks.load --url http://127.0.0.1:8000 --users 20
+
+    Every flow uploads its own dataset (same shape, seeded by flow), so each
+    one runs parsing, cleaning and analysis. With --same-payload all flows
+    upload one file, and after the first they only link to the stored
+    dataset and hit the LLM response cache.
+    Memory growth is only reported for the in-process app.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+
+# in-process runs never reach the model endpoint
+os.environ.setdefault("LLM_TRANSPORT", "replay")
+os.environ.setdefault("BASE_URL", "http://localhost.invalid")
+os.environ.setdefault("API_KEY", "offline-benchmark")
+
+import httpx
+
+from benchmarks.datasets import make_dataset, to_bytes
+
+
+# resident memory of this process in bytes
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.requests = {}
+        self.flows = []
+        self.errors = {}
+
+    async def timed(self, name: str, call):
+        start = time.perf_counter()
+        response = await call
+        self.requests.setdefault(name, []).append(time.perf_counter() - start)
+        return response
+
+    def error(self, reason: str):
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+
+# one user session through the whole flow
+async def run_flow(client: httpx.AsyncClient, payload: bytes, recorder: Recorder,
+                   poll_interval: float, timeout: float, quit_report: bool):
+    start = time.perf_counter()
+
+    response = await recorder.timed("upload", client.post(
+        "/upload", files={"file": ("load.csv", payload, "text/csv")}))
+    location = response.headers.get("location", "")
+    if response.status_code != 303 or not location.startswith("/clean/"):
+        recorder.error("upload_rejected")
+        return
+
+    clean_id = location.rsplit("/", 1)[-1]
+    await recorder.timed("clean", client.get(location))
+
+    # poll until the background job finishes
+    status = None
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        response = await recorder.timed("status", client.get(f"/status/{clean_id}"))
+        if response.status_code != 200:
+            status = "missing"
+            break
+        status = response.json()["status"]
+        if status in ("done", "failed"):
+            break
+        await asyncio.sleep(poll_interval)
+
+    if status != "done":
+        recorder.error(f"job_{status or 'timeout'}")
+        await client.get("/quit_report")
+        return
+
+    response = await recorder.timed("report", client.get(f"/report/{clean_id}"))
+    if response.status_code != 200:
+        recorder.error("report_failed")
+        return
+
+    await recorder.timed("rows", client.get(f"/rows/{clean_id}", params={"draw": 1, "start": 10, "length": 10}))
+
+    recorder.flows.append(time.perf_counter() - start)
+
+    if quit_report:
+        await client.get("/quit_report")
+
+
+# upload per flow, distinct so that identical-upload dedup does not skip the pipeline
+def make_payloads(args) -> list:
+    flows = 1 if args.same_payload else args.users * args.iterations
+    return [to_bytes(make_dataset(args.rows, args.cols, "monthly", seed=seed), "csv") for seed in range(flows)]
+
+
+async def run_user(make_client, payloads: list, user: int, recorder: Recorder, args):
+    for iteration in range(args.iterations):
+        payload = payloads[(user * args.iterations + iteration) % len(payloads)]
+        # fresh cookie jar per flow, like a new browser session
+        async with make_client() as client:
+            try:
+                await run_flow(client, payload, recorder, args.poll_interval, args.timeout,
+                               not args.keep_sessions)
+            except httpx.HTTPError as e:
+                recorder.error(type(e).__name__)
+
+
+async def run(args) -> dict:
+    payloads = make_payloads(args)
+    recorder = Recorder()
+
+    if args.url:
+        def make_client():
+            return httpx.AsyncClient(base_url=args.url, follow_redirects=False, timeout=args.timeout)
+        memory_before = None
+    else:
+        from app.main import app
+
+        def make_client():
+            return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver",
+                                     follow_redirects=False, timeout=args.timeout)
+        memory_before = rss_bytes()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(make_client, payloads, user, recorder, args) for user in range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "users": args.users,
+        "iterations": args.iterations,
+        "rows": args.rows,
+        "same_payload": args.same_payload,
+        "elapsed_seconds": elapsed,
+        "completed_flows": len(recorder.flows),
+        "throughput_flows_per_second": len(recorder.flows) / elapsed if elapsed else None,
+        "flow_latency": summarize(recorder.flows),
+        "request_latency": {name: summarize(values) for name, values in recorder.requests.items()},
+        "errors": recorder.errors
+    }
+
+    if memory_before is not None:
+        memory_after = rss_bytes()
+        result["memory"] = {
+            "rss_before": memory_before,
+            "rss_after": memory_after,
+            "rss_growth": memory_after - memory_before
+        }
+
+    return result
+
+
+def print_result(result: dict):
+    ms = lambda v: f"{v * 1000:8.1f}" if v is not None else "       -"
+
+    same = ", same payload" if result["same_payload"] else ""
+    print(f"\n{result['users']} users x {result['iterations']} flows, {result['rows']} rows{same}")
+    print(f"  completed flows   {result['completed_flows']} in {result['elapsed_seconds']:.2f}s "
+          f"({result['throughput_flows_per_second'] or 0:.2f} flows/s)")
+    print(f"  {'latency (ms)':<16} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+
+    rows = [("flow", result["flow_latency"])] + list(result["request_latency"].items())
+    for name, stats in rows:
+        print(f"  {name:<16} {ms(stats['p50'])} {ms(stats['p95'])} {ms(stats['p99'])} {ms(stats['max'])}")
+
+    if result["errors"]:
+        print(f"  errors            {result['errors']}")
+    if "memory" in result:
+        memory = result["memory"]
+        print(f"  rss               {memory['rss_before'] / 1024 / 1024:.1f} MB -> "
+              f"{memory['rss_after'] / 1024 / 1024:.1f} MB (+{memory['rss_growth'] / 1024 / 1024:.1f} MB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent load test of the InsightAI report flow.")
+    parser.add_argument("--users", type=int, default=10, help="simultaneous users")
+    parser.add_argument("--iterations", type=int, default=1, help="flows per user")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--url", help="base url of a running server, default runs the app in-process")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--same-payload", action="store_true",
+                        help="upload one file in every flow (exercises dataset dedup)")
+    parser.add_argument("--keep-sessions", action="store_true", help="do not call /quit_report")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    print_result(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+    Offline benchmark of the data path on synthetic datasets.
+
+    Usage:
+        python -m benchmarks.run
+        python -m benchmarks.run --rows 1000 25000 100000 --cols 8 32 --mixes numeric text --formats csv xlsx
+        python -m benchmarks.run --json bench_output.json
+
+    No request leaves the machine: the LLM stages use canned intents
+    (app/lib/TEST_INTRES*.json for the "monthly" mix, generated ones otherwise).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# app.utils.env requires these, nothing is sent to them
+os.environ.setdefault("BASE_URL", "http://localhost.invalid")
+os.environ.setdefault("API_KEY", "offline-benchmark")
+
+import pandas as pd
+from starlette.datastructures import UploadFile
+
+from app.api.routes import templates, ROWS_PAGE_SIZE
+from app.crud import file_handler
+from app.crud.openai import intent_prompt, insight_prompt, analyze_intent, combine_results
+from app.crud.profiler import profile_df
+from app.utils.config import SESSION_STORE
+from app.utils.env import MAX_ROWS
+from benchmarks.datasets import MIXES, make_dataset, make_intents, to_bytes
+
+LIB_DIR = Path(__file__).resolve().parent.parent / "app" / "lib"
+
+STAGES = ["read_validate_file", "profile_df", "micro_clean", "compact_df", "intent_prompt",
+          "analyze_intent", "insight_prompt", "report_render"]
+
+
+# canned intents for the monthly mix
+def fixture_intents() -> list:
+    intents = []
+    for name in ("TEST_INTRES.json", "TEST_INTRES_2.json"):
+        with open(LIB_DIR / name, "r", encoding="utf-8") as f:
+            intents.extend(json.load(f))
+    return intents
+
+
+# time fn over repeats, then one traced run for peak memory
+def measure(fn, repeat: int) -> dict:
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "result": result,
+        "seconds": statistics.median(times),
+        "peak_bytes": peak
+    }
+
+
+def read_upload(payload: bytes, filename: str) -> str:
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(payload)
+    spooled.seek(0)
+    upload = UploadFile(file=spooled, filename=filename)
+    try:
+        return asyncio.run(file_handler.read_validate_file(upload))
+    finally:
+        spooled.close()
+
+
+def read_upload_once(payload: bytes, filename: str):
+    clean_id = read_upload(payload, filename)
+    if clean_id is not None:
+        SESSION_STORE.delete(clean_id)
+    return clean_id
+
+
+def render_report(df: pd.DataFrame, combined: list) -> str:
+    first_page = file_handler.paginate_rows(df, start=0, length=ROWS_PAGE_SIZE)
+    return templates.env.get_template("report.html").render({
+        "request": None,
+        "clean_id": "benchmark",
+        "columns": list(df.columns),
+        "dtypes": df.dtypes,
+        "rows": first_page["data"],
+        "total_rows": first_page["recordsTotal"],
+        "page_size": ROWS_PAGE_SIZE,
+        "openai_response": combined,
+        "success": "",
+        "runtime": 0,
+        "is_active": True
+    })
+
+
+# run every stage for one dataset
+def run_case(rows: int, cols: int, mix: str, fmt: str, repeat: int) -> dict:
+    raw = make_dataset(rows, cols, mix)
+    payload = to_bytes(raw, fmt)
+    filename = f"benchmark.{fmt}"
+
+    case = {"rows": rows, "cols": cols, "mix": mix, "format": fmt,
+            "file_bytes": len(payload), "stages": {}}
+
+    read = measure(lambda: read_upload_once(payload, filename), repeat)
+    case["stages"]["read_validate_file"] = {
+        "seconds": read["seconds"], "peak_bytes": read["peak_bytes"],
+        "accepted": read["result"] is not None
+    }
+
+    # rows beyond the cap are rejected, keep measuring the rest of the path
+    if fmt == "csv":
+        df = pd.read_csv(io.BytesIO(payload))
+    else:
+        df = pd.read_excel(io.BytesIO(payload))
+
+    profiled = measure(lambda: profile_df(df), repeat)
+    profile = profiled["result"]
+    case["stages"]["profile_df"] = {"seconds": profiled["seconds"], "peak_bytes": profiled["peak_bytes"]}
+
+    clean = measure(lambda: file_handler.micro_clean(df.copy(), None, profile), repeat)
+    processed_df = clean["result"]
+    case["stages"]["micro_clean"] = {"seconds": clean["seconds"], "peak_bytes": clean["peak_bytes"]}
+
+    uncompacted_df = processed_df
+    report = {}
+    compact = measure(lambda: file_handler.compact_df(processed_df.copy(), report), repeat)
+    processed_df = compact["result"]
+    case["stages"]["compact_df"] = {"seconds": compact["seconds"], "peak_bytes": compact["peak_bytes"],
+                                    **report}
+
+    prompt = measure(lambda: intent_prompt(processed_df, None, profile), repeat)
+    case["stages"]["intent_prompt"] = {"seconds": prompt["seconds"], "peak_bytes": prompt["peak_bytes"],
+                                       "prompt_chars": len(prompt["result"])}
+
+    intents = make_intents(processed_df, mix) if mix != "monthly" else fixture_intents()
+    response = json.dumps(intents)
+    analyze = measure(lambda: analyze_intent(processed_df, response), repeat)
+    intent_res = analyze["result"]
+    case["stages"]["analyze_intent"] = {"seconds": analyze["seconds"], "peak_bytes": analyze["peak_bytes"],
+                                        "topics": len(json.loads(intent_res)) if intent_res else 0,
+                                        "matches_uncompacted": intent_res == analyze_intent(uncompacted_df, response)}
+
+    if intent_res is None:
+        return case
+
+    insight = measure(lambda: insight_prompt(intent_res), repeat)
+    case["stages"]["insight_prompt"] = {"seconds": insight["seconds"], "peak_bytes": insight["peak_bytes"],
+                                        "prompt_chars": len(insight["result"])}
+
+    insights = [{"insight": "", "chart_type": "bar"} for _ in json.loads(intent_res)]
+    combined = combine_results(intent_res, insights)
+    render = measure(lambda: render_report(processed_df, combined), repeat)
+    case["stages"]["report_render"] = {"seconds": render["seconds"], "peak_bytes": render["peak_bytes"],
+                                       "html_bytes": len(render["result"].encode("utf-8"))}
+
+    return case
+
+
+def print_case(case: dict):
+    print(f"\n{case['mix']} / {case['format']} / {case['rows']} rows x {case['cols']} cols "
+          f"({case['file_bytes'] / 1024:.0f} KB)")
+    for stage in STAGES:
+        stats = case["stages"].get(stage)
+        if stats is None:
+            continue
+        extra = ""
+        if stage == "read_validate_file" and not stats["accepted"]:
+            extra = " (rejected)"
+        elif stage == "analyze_intent" and not stats["matches_uncompacted"]:
+            extra = " (differs from the uncompacted frame)"
+        elif "bytes_after" in stats:
+            extra = f" ({stats['bytes_before'] / 1024:.0f} KB -> {stats['bytes_after'] / 1024:.0f} KB)"
+        print(f"  {stage:<20} {stats['seconds'] * 1000:>10.1f} ms  {stats['peak_bytes'] / 1024 / 1024:>8.1f} MB{extra}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the InsightAI data path.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, MAX_ROWS, MAX_ROWS * 2])
+    parser.add_argument("--cols", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--mixes", nargs="+", default=MIXES, choices=MIXES)
+    parser.add_argument("--formats", nargs="+", default=["csv"], choices=["csv", "xlsx"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    if "xlsx" in args.formats:
+        try:
+            import openpyxl
+        except ImportError:
+            print("openpyxl is not installed, skipping xlsx datasets", file=sys.stderr)
+            args.formats = [f for f in args.formats if f != "xlsx"]
+
+    cases = []
+    for fmt in args.formats:
+        for mix in args.mixes:
+            for cols in args.cols:
+                for rows in args.rows:
+                    case = run_case(rows, cols, mix, fmt, args.repeat)
+                    print_case(case)
+                    cases.append(case)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(cases, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()